@@ -1,14 +1,41 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, Response, stream_with_context
 
-import requests
 import json
+import math
 import os
 from dotenv import load_dotenv
 import re
+import subprocess
+import time
+import uuid
 from pymongo import MongoClient
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import bcrypt
 from datetime import datetime
+from llm_client import UpstreamClient, UpstreamError
+from local_store import LocalStore
+from model_health import ModelHealth
+from chat_cache import ChatResponseCache, make_key, prompt_version
+from singleflight import SingleFlight
+from conversations import ConversationStore, estimate_tokens
+from pymongo.errors import PyMongoError
+from collections import namedtuple
+from sandbox_pool import JavaPool, NodePool, PythonPool, run_command
+from compile_cache import CompileCache, JavaToolchain
+from job_queue import JobQueue, QueueFull, truncate_output
+from resource_governor import CgroupGovernor, ResourceLimits, rlimits
+from execution_cache import ExecutionCache
+from html_rewriter import PreviewCache
+from static_files import PrecompressedFiles
+from file_catalog import FileCatalog
+from project_files import extract_files, with_extension
+from workspace_store import WorkspaceStore
+from project_export import ProjectExporter
+from user_cache import UserCache
+from users import AccountExists, UserStore
+from password_hashing import HashingBusy, PasswordHasher
+from rate_limiter import ChatRateLimiter, RateLimited
+from usage_ledger import UsageLedger, sum_rollups
 
 # Load environment variables
 load_dotenv()
@@ -16,13 +43,44 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Behind PROXY_HOPS reverse proxies (1 on Render), take the client address from
+# X-Forwarded-For, so logged-out users get their own rate limits and job queues
+# instead of all sharing the proxy's. Leave at 0 when clients connect directly,
+# or anyone could pick their address with the header.
+PROXY_HOPS = int(os.getenv('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
 
 
-# MongoDB configuration
+
+# MongoDB configuration; the pool and timeouts are per gunicorn worker
 MONGODB_URI = os.getenv('MONGODB_URI')
-client = MongoClient(MONGODB_URI)
+client = MongoClient(
+    MONGODB_URI,
+    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+    minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    maxIdleTimeMS=int(os.getenv('MONGO_MAX_IDLE_MS', 300000)),
+    waitQueueTimeoutMS=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    serverSelectionTimeoutMS=int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    connectTimeoutMS=int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    socketTimeoutMS=int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000))
+)
 db = client.devcoder_ai
 users_collection = db.users
+conversations_collection = db.conversations
+user_store = UserStore(users_collection)
+
+USAGE_DASHBOARD_DAYS = 14
+# Per-user usage (tokens, latency, cache hits, sandbox CPU) buffered in each worker
+# and written to MongoDB in batches, with daily rollups for the dashboard
+usage_ledger = UsageLedger(
+    db.usage_events,
+    db.usage_daily,
+    flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 2)),
+    batch_size=int(os.getenv('USAGE_BATCH_SIZE', 500)),
+    max_buffered=int(os.getenv('USAGE_MAX_BUFFERED', 10000)),
+    retention_days=int(os.getenv('USAGE_RETENTION_DAYS', 90))
+)
 
 # Flask-Login configuration
 login_manager = LoginManager()
@@ -33,21 +91,175 @@ login_manager.login_view = 'login'
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 
+# Host-local store shared by all workers (model health, caches)
+local_store = LocalStore(os.getenv('LOCAL_STORE_PATH', os.path.join('.cache', 'local_store.sqlite3')))
+
+# bcrypt runs on a small bounded pool per worker so login bursts can't starve other requests;
+# the cost is BCRYPT_ROUNDS, or calibrated to about BCRYPT_TARGET_MS per hash
+password_hasher = PasswordHasher(
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+    max_pending=int(os.getenv('PASSWORD_HASH_QUEUE', 16)),
+    rounds=int(os.getenv('BCRYPT_ROUNDS')) if os.getenv('BCRYPT_ROUNDS') else None,
+    target_ms=int(os.getenv('BCRYPT_TARGET_MS', 250)),
+    store=local_store
+)
+
+# Rolling per-model health with circuit breaking, used to order the fallback chain
+model_health = ModelHealth(
+    local_store,
+    window=int(os.getenv('MODEL_HEALTH_WINDOW', 300)),
+    open_seconds=int(os.getenv('MODEL_CIRCUIT_OPEN_SECONDS', 30))
+)
+
+# Per-user and app-wide token buckets in front of the upstream API, plus each
+# model's quota as reported by the provider's rate limit headers
+chat_rate_limiter = ChatRateLimiter(
+    local_store,
+    user_tokens_per_minute=int(os.getenv('RATE_USER_TOKENS_PER_MINUTE', 20000)),
+    user_requests_per_minute=int(os.getenv('RATE_USER_REQUESTS_PER_MINUTE', 20)),
+    global_tokens_per_minute=int(os.getenv('RATE_GLOBAL_TOKENS_PER_MINUTE', 100000)),
+    global_requests_per_minute=int(os.getenv('RATE_GLOBAL_REQUESTS_PER_MINUTE', 120)),
+    max_wait=float(os.getenv('RATE_MAX_WAIT', 5))
+)
+
+# Shared keep-alive client for the upstream LLM API
+llm_client = UpstreamClient(
+    GROQ_API_URL,
+    GROQ_API_KEY,
+    pool_size=int(os.getenv('GROQ_POOL_SIZE', 10)),
+    connect_timeout=float(os.getenv('GROQ_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('GROQ_READ_TIMEOUT', 15)),
+    health=model_health,
+    rate_limiter=chat_rate_limiter
+)
+
+# Chat model configuration
+# CHAT_MODELS is the fallback order (primary first). CHAT_HEDGE_DELAYS are the
+# seconds to wait on the running attempts before starting the next model; the
+# last delay repeats for the rest of the list.
+DEFAULT_CHAT_HEDGE_DELAYS = [2.5]
+CHAT_MODELS = [m.strip() for m in os.getenv('CHAT_MODELS', 'llama-3.1-8b-instant,gemma2-9b-it,mixtral-8x7b-32768,llama3-groq-70b-8192-tool-use-preview').split(',') if m.strip()]
+
+def parse_hedge_delays(value):
+    """CHAT_HEDGE_DELAYS as a non-empty list of seconds; blank means the default"""
+    delays = [float(d) for d in (value or '').split(',') if d.strip()]
+    if any(d < 0 for d in delays):
+        raise ValueError(f"CHAT_HEDGE_DELAYS must not be negative: {value!r}")
+    if not delays:
+        print(f"CHAT_HEDGE_DELAYS is empty, using {DEFAULT_CHAT_HEDGE_DELAYS}")
+        return list(DEFAULT_CHAT_HEDGE_DELAYS)
+    return delays
+
+CHAT_HEDGE_DELAYS = parse_hedge_delays(os.getenv('CHAT_HEDGE_DELAYS', '2.5'))
+SYSTEM_PROMPT = "You are DevCoder AI created by Siddharth Chauhan, a specialized coding assistant. IMPORTANT CONTEXT RULES: 1) Only provide code when user asks programming-related questions (like 'write a function', 'create a website', 'build an app', 'hello world program', etc.) 2) For casual greetings ('hi', 'hello', 'how are you') respond conversationally without code 3) For general questions, provide helpful answers without unnecessary code examples 4) CODING RULES (only when code is requested): Never ask 'what language?' - choose appropriate language or provide multiple 5) For website requests, create SEPARATE files: index.html, style.css, script.js 6) CRITICAL: When creating HTML files, use these EXACT link patterns: <link rel='stylesheet' href='style.css'> for CSS and <script src='script.js'></script> for JavaScript - NO other variations! 7) For 'hello world' requests, provide code in multiple languages 8) Always suggest proper filenames 9) Keep coding responses concise - code first, brief explanation after 10) For GUI requests, create complete working code 11) Make reasonable assumptions, don't ask for clarification 12) Use proper code blocks with language tags 13) ALWAYS use standard filenames: index.html, style.css, script.js for web projects"
+CHAT_TEMPERATURE = 0.3
+SYSTEM_PROMPT_VERSION = prompt_version(SYSTEM_PROMPT)
+
+# Cache of answers to repeated prompts; CHAT_CACHE_SHARED=1 adds a tier shared by all workers
+CHAT_CACHE_SHARED = os.getenv('CHAT_CACHE_SHARED', '0') == '1'
+chat_cache = ChatResponseCache(
+    ttl=int(os.getenv('CHAT_CACHE_TTL', 3600)),
+    max_entries=int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 1000)),
+    store=local_store if CHAT_CACHE_SHARED else None
+)
+
+# Identical in-flight prompts share one upstream call. Across workers the
+# answer is handed over through the shared cache tier, so that needs it too.
+chat_flights = SingleFlight(store=local_store if CHAT_CACHE_SHARED else None)
+
+# Conversation memory; history sent upstream is capped at this many (estimated) tokens
+conversation_store = ConversationStore(
+    conversations_collection,
+    token_budget=int(os.getenv('CONVERSATION_TOKEN_BUDGET', 3000)),
+    summary_budget=int(os.getenv('CONVERSATION_SUMMARY_BUDGET', 400))
+)
+
+EXECUTION_TIMEOUT = 10
+
+# Resource limits for each /execute run. SANDBOX_CGROUP (a delegated cgroup v2
+# directory) adds per-run memory.max, cpu.max and pids.max where available.
+execution_limits = ResourceLimits(
+    cpu_seconds=EXECUTION_TIMEOUT,
+    memory_bytes=int(os.getenv('SANDBOX_MEMORY_MB', 256)) * 1024 * 1024,
+    processes=int(os.getenv('SANDBOX_MAX_PROCESSES', 256)),
+    file_size_bytes=int(os.getenv('SANDBOX_MAX_FILE_MB', 16)) * 1024 * 1024,
+    cpu_quota=float(os.getenv('SANDBOX_CPU_QUOTA', 1.0))
+)
+sandbox_cgroups = CgroupGovernor(os.getenv('SANDBOX_CGROUP'), execution_limits)
+
+# Pre-started interpreters for /execute, so snippets don't pay process startup
+SANDBOX_POOL_SIZE = int(os.getenv('SANDBOX_POOL_SIZE', 2))
+sandbox_pools = {
+    'python': PythonPool(size=SANDBOX_POOL_SIZE, max_jobs=int(os.getenv('SANDBOX_MAX_JOBS', 200)),
+                         limits=execution_limits, cgroups=sandbox_cgroups).start(),
+    'javascript': NodePool(size=SANDBOX_POOL_SIZE, limits=execution_limits, cgroups=sandbox_cgroups).start(),
+    'java': JavaPool(os.path.join('.cache', 'sandbox'), size=min(SANDBOX_POOL_SIZE, 1), limits=execution_limits).start()
+}
+
+# Compiled output keyed by source hash and toolchain version, so re-running unchanged code skips the compiler
+compile_cache = CompileCache(os.path.join('.cache', 'compiled'),
+                             max_bytes=int(os.getenv('COMPILE_CACHE_MAX_MB', 256)) * 1024 * 1024)
+compile_cache.register('java', JavaToolchain(sandbox_pools['java']))
+
+# /execute and /terminal run as background jobs so request workers never wait on user code.
+# Users are served round-robin; across all workers on the host each may have
+# JOB_QUEUE_PER_USER jobs waiting and JOB_RUNNING_PER_USER running.
+job_queue = JobQueue(
+    local_store,
+    workers=int(os.getenv('JOB_WORKERS', 4)),
+    max_queued_per_user=int(os.getenv('JOB_QUEUE_PER_USER', 5)),
+    max_queued=int(os.getenv('JOB_QUEUE_MAX', 100)),
+    output_limit=int(os.getenv('JOB_OUTPUT_MAX_KB', 256)) * 1024,
+    max_running_per_user=int(os.getenv('JOB_RUNNING_PER_USER', 2))
+)
+JOB_EVENTS_MAX_SECONDS = 90
+
+# Results of deterministic snippets, for /execute requests that opt in with "cache": true
+execution_cache = ExecutionCache(
+    max_entries=int(os.getenv('EXECUTION_CACHE_MAX_ENTRIES', 500)),
+    ttl=int(os.getenv('EXECUTION_CACHE_TTL', 24 * 3600))
+)
+
+# Preview pages, rewritten once per file version instead of on every iframe reload
+preview_cache = PreviewCache()
+
+# gzip/brotli variants of generated text assets, made once per file version
+precompressed_files = PrecompressedFiles(os.path.join('.cache', 'precompressed'))
+
+# Indexed listing of the shared generated_code/ directory, reconciled with what is on disk
+file_catalog = FileCatalog(local_store, 'generated_code')
+os.makedirs('generated_code', exist_ok=True)
+
+# Per-user workspaces with deduplicated, content-addressed blobs; generated_code/ is the fallback
+workspaces = WorkspaceStore(local_store, os.getenv('WORKSPACE_ROOT', 'workspaces'), legacy_directory='generated_code')
+
+# Zip exports of workspaces, streamed and kept until the cache outgrows its size
+project_exporter = ProjectExporter(os.path.join('.cache', 'exports'),
+                                   max_bytes=int(os.getenv('EXPORT_CACHE_MAX_MB', 256)) * 1024 * 1024)
+
 # User class for Flask-Login
+# The only user fields a session needs; never load the password hash per request
+USER_SESSION_FIELDS = {'_id': 1, 'username': 1, 'email': 1}
+
 class User(UserMixin):
     def __init__(self, user_data):
         self.id = str(user_data['_id'])
         self.username = user_data['username']
         self.email = user_data['email']
 
-@login_manager.user_loader
-def load_user(user_id):
-    from bson import ObjectId
-    user_data = users_collection.find_one({'_id': ObjectId(user_id)})
+def fetch_user(user_id):
+    user_data = user_store.by_id(user_id, USER_SESSION_FIELDS)
     if user_data:
         return User(user_data)
     return None
 
+# Logged-in users, so authenticated requests don't each cost a MongoDB round trip
+user_cache = UserCache(fetch_user, ttl=int(os.getenv('USER_CACHE_TTL', 60)), store=local_store)
+
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.get(user_id)
+
 @app.route('/')
 def index():
     # If user is already logged in, redirect to dashboard
@@ -63,7 +275,13 @@ def chat_page():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('dashboard.html')
+    try:
+        usage_days = usage_ledger.daily(current_user.id, days=USAGE_DASHBOARD_DAYS)
+    except PyMongoError as e:
+        print(f"Could not load usage rollups: {e}")
+        usage_days = []
+    return render_template('dashboard.html', usage_days=usage_days, usage_totals=sum_rollups(usage_days),
+                           usage_period=USAGE_DASHBOARD_DAYS)
 
 @app.route('/editor')
 @login_required
@@ -86,10 +304,19 @@ def login():
             username = request.form.get('username')
             password = request.form.get('password')
         
-        user_data = users_collection.find_one({'username': username})
+        user_data = user_store.by_username(username)
+        try:
+            matches, new_hash = (password_hasher.check(password, user_data['password'])
+                                 if user_data and password else (False, None))
+        except HashingBusy as e:
+            return auth_busy(str(e), 'login.html')
         
-        if user_data and bcrypt.checkpw(password.encode('utf-8'), user_data['password']):
+        if matches:
+            if new_hash is not None:
+                # Stored at a different cost than the current one
+                user_store.update_password(user_data['_id'], user_data['password'], new_hash)
             user = User(user_data)
+            user_cache.set(user.id, user)
             login_user(user)
             if request.is_json:
                 return jsonify({'success': True, 'message': 'Login successful'})
@@ -105,9 +332,17 @@ def login():
     
     return render_template('login.html')
 
+def auth_busy(message, template):
+    """503 for a login or signup turned away because the hashing pool is full"""
+    if request.is_json:
+        return jsonify({'success': False, 'message': message}), 503, {'Retry-After': '2'}
+    flash(message, 'error')
+    return render_template(template), 503, {'Retry-After': '2'}
+
 @app.route('/logout')
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('index'))
 
@@ -129,23 +364,11 @@ def signup():
             email = request.form.get('email')
             password = request.form.get('password')
         
-        # Check if user already exists
-        if users_collection.find_one({'username': username}):
-            if request.is_json:
-                return jsonify({'success': False, 'message': 'Username already exists'})
-            else:
-                flash('Username already exists', 'error')
-                return render_template('signup.html')
-        
-        if users_collection.find_one({'email': email}):
-            if request.is_json:
-                return jsonify({'success': False, 'message': 'Email already registered'})
-            else:
-                flash('Email already registered', 'error')
-                return render_template('signup.html')
-        
         # Hash password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashingBusy as e:
+            return auth_busy(str(e), 'signup.html')
         
         # Create user
         user_doc = {
@@ -155,10 +378,19 @@ def signup():
             'created_at': datetime.utcnow()
         }
         
-        result = users_collection.insert_one(user_doc)
+        # One insert; the unique indexes reject a taken username or email
+        try:
+            user_store.create(user_doc)
+        except AccountExists as e:
+            if request.is_json:
+                return jsonify({'success': False, 'message': str(e)})
+            else:
+                flash(str(e), 'error')
+                return render_template('signup.html')
         
-        if result.inserted_id:
+        if user_doc.get('_id'):
             user = User(user_doc)
+            user_cache.set(user.id, user)
             login_user(user)
             if request.is_json:
                 return jsonify({'success': True, 'message': 'Account created successfully'})
@@ -178,194 +410,442 @@ def signup():
 @app.route('/preview/<filename>')
 def preview_file(filename):
     try:
-        file_path = os.path.join('generated_code', filename)
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # For HTML files, fix relative paths to absolute paths
-            if filename.endswith('.html'):
-                # Comprehensive path replacement for CSS files
-                import re
-                
-                # Replace various CSS link patterns
-                css_patterns = [
-                    (r'href=["\'](?!http|//)([^"\']*)\.(css)["\']', r'href="/generated_code/\1.\2"'),
-                    (r'href=["\']\./([^"\']*)\.(css)["\']', r'href="/generated_code/\1.\2"'),
-                    (r'href=["\']([^"\'/]*\.css)["\']', r'href="/generated_code/\1"')
-                ]
-                
-                # Replace various JS script patterns
-                js_patterns = [
-                    (r'src=["\'](?!http|//)([^"\']*)\.(js)["\']', r'src="/generated_code/\1.\2"'),
-                    (r'src=["\']\./([^"\']*)\.(js)["\']', r'src="/generated_code/\1.\2"'),
-                    (r'src=["\']([^"\'/]*\.js)["\']', r'src="/generated_code/\1"')
-                ]
-                
-                # Apply CSS patterns
-                for pattern, replacement in css_patterns:
-                    content = re.sub(pattern, replacement, content, flags=re.IGNORECASE)
-                
-                # Apply JS patterns
-                for pattern, replacement in js_patterns:
-                    content = re.sub(pattern, replacement, content, flags=re.IGNORECASE)
-                
-                # Also handle image and other asset references
-                asset_patterns = [
-                    (r'src=["\'](?!http|//)([^"\']*)\.(png|jpg|jpeg|gif|svg|ico|webp)["\']', r'src="/generated_code/\1.\2"'),
-                    (r'href=["\'](?!http|//)([^"\']*)\.(png|jpg|jpeg|gif|svg|ico|webp)["\']', r'href="/generated_code/\1.\2"')
-                ]
-                
-                for pattern, replacement in asset_patterns:
-                    content = re.sub(pattern, replacement, content, flags=re.IGNORECASE)
-                
-                return content, 200, {'Content-Type': 'text/html'}
-            elif filename.endswith('.css'):
-                return content, 200, {'Content-Type': 'text/css'}
-            elif filename.endswith('.js'):
-                return content, 200, {'Content-Type': 'application/javascript'}
-            else:
-                return content
-        else:
+        file_path = workspaces.resolve(workspace_namespace(), filename)
+        if file_path is None:
             return "File not found", 404
+        try:
+            # HTML comes back with its asset paths pointed at /generated_code/
+            content = preview_cache.load(file_path, filename)
+        except FileNotFoundError:
+            return "File not found", 404
+        
+        if filename.endswith('.html'):
+            return content, 200, {'Content-Type': 'text/html'}
+        elif filename.endswith('.css'):
+            return content, 200, {'Content-Type': 'text/css'}
+        elif filename.endswith('.js'):
+            return content, 200, {'Content-Type': 'application/javascript'}
+        else:
+            return content
     except Exception as e:
         return f"Error: {str(e)}", 500
 
 @app.route('/generated_code/<filename>')
 def serve_generated_file(filename):
     try:
-        file_path = os.path.join('generated_code', filename)
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Set proper content type
-            if filename.endswith('.css'):
-                return content, 200, {'Content-Type': 'text/css'}
-            elif filename.endswith('.js'):
-                return content, 200, {'Content-Type': 'application/javascript'}
-            else:
-                return content
-        else:
+        file_path = workspaces.resolve(workspace_namespace(), filename)
+        if file_path is None or not os.path.isfile(file_path):
             return "File not found", 404
+        return precompressed_files.send(file_path, request.headers.get('Accept-Encoding'),
+                                        has_range='Range' in request.headers, name=filename)
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+def chat_cache_key(user_message):
+    # Keyed on the requested (primary) model; the model that answered is stored in the entry
+    return make_key(user_message, CHAT_MODELS[0], CHAT_TEMPERATURE, SYSTEM_PROMPT_VERSION)
+
+ChatContext = namedtuple('ChatContext', ['conversation_id', 'history', 'summary', 'summarized_count'])
+
+def load_chat_context(data, user_id):
+    """Resolve (or start) the caller's conversation and the history to send upstream"""
+    if user_id is None:
+        return ChatContext(None, [], '', None)
+    try:
+        conversation_id = data.get('conversation_id')
+        conversation = conversation_store.load(conversation_id, user_id) if conversation_id else None
+        if conversation is None:
+            conversation_id = conversation_store.create(user_id, data['message'])
+            return ChatContext(conversation_id, [], '', 0)
+        history, summary, summarized_count = conversation_store.build_context(conversation)
+        return ChatContext(conversation_id, history, summary, summarized_count)
+    except PyMongoError as e:
+        # Memory is best effort; answer statelessly rather than fail the chat
+        print(f"Conversation lookup failed: {e}")
+        return ChatContext(None, [], '', None)
+
+def save_chat_turn(context, user_id, user_message, answer):
+    if context.conversation_id is None:
+        return
+    try:
+        conversation_store.append(context.conversation_id, user_id, user_message, answer['response'], answer['model'],
+                                  summary=context.summary, summarized_count=context.summarized_count)
+    except PyMongoError as e:
+        print(f"Failed to save conversation turn: {e}")
+
+def build_chat_payload(user_message, model, stream=False, context=None):
+    """Request body for the Groq chat completions endpoint"""
+    messages = [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        }
+    ]
+    if context is not None:
+        if context.summary:
+            messages.append({
+                "role": "system",
+                "content": "Summary of the earlier conversation:\n" + context.summary
+            })
+        messages.extend(context.history)
+    messages.append({
+        "role": "user",
+        "content": user_message + " (Remember: For HTML files, use href='style.css' and src='script.js' - standard relative paths only!)"
+    })
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": 2000,
+        "temperature": CHAT_TEMPERATURE
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+# Completion tokens charged up front, before the provider reports the real usage
+EXPECTED_COMPLETION_TOKENS = 500
+
+def estimate_chat_tokens(payload):
+    """Tokens a chat request is expected to use: its prompt plus a typical answer"""
+    return sum(estimate_tokens(message['content']) for message in payload['messages']) + EXPECTED_COMPLETION_TOKENS
+
+def rate_limited_response(error):
+    """429 for a chat request held back by the rate limiter"""
+    retry_after = max(1, math.ceil(error.retry_after or 1))
+    headers = dict(error.headers, **{'Retry-After': str(retry_after)})
+    return jsonify({'error': str(error), 'retry_after': retry_after}), 429, headers
+
+def elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000)
+
+def get_fallback_response(user_message):
+    """Canned reply used when every upstream model failed"""
+    # Enhanced intelligent fallback responses
+    import random
+    user_lower = user_message.lower()
+
+    # Check for creator-related questions first
+    if any(word in user_lower for word in ['who made you', 'who created you', 'creator', 'developer', 'built you', 'siddharth', 'chauhan']):
+        responses = [
+            "I'm DevCoder AI, created by Siddharth Chauhan - a skilled developer who built me as a specialized coding assistant. I'm designed to help with programming tasks, code reviews, debugging, and technical solutions using Flask and AI integration.",
+            "My creator is Siddharth Chauhan! He developed me as DevCoder AI to assist developers with coding challenges. Built with Flask and integrated with advanced AI models, I focus on providing structured code solutions and technical guidance.",
+            "I was built by Siddharth Chauhan as DevCoder AI - your dedicated coding companion. He designed me to understand developer needs and provide practical, well-formatted code solutions with proper syntax highlighting."
+        ]
+    elif any(word in user_lower for word in ['python', 'javascript', 'code', 'programming', 'html', 'css', 'react', 'nodejs', 'function', 'class', 'variable', 'loop', 'array', 'object']):
+        responses = [
+            "Let me help you with coding! Here's a practical example with proper formatting and best practices.",
+            "Great programming question! I'll provide you with clean, well-structured code examples and explanations.",
+            "I'll show you how to implement this with proper syntax highlighting and developer-friendly formatting."
+        ]
+    elif any(word in user_lower for word in ['ai', 'artificial intelligence', 'machine learning', 'neural network', 'deep learning']):
+        responses = [
+            f"Fascinating topic! {user_message} is at the forefront of modern technology. Let me explain how it works and its real-world applications.",
+            f"Great question about {user_message}! AI and machine learning are transforming industries. Here's a comprehensive overview...",
+            f"I love discussing {user_message}! This field combines mathematics, computer science, and data analysis in amazing ways."
+        ]
+    elif "?" in user_message:
+        responses = [
+            f"Excellent question about '{user_message}'! Let me provide you with a detailed and informative answer based on current knowledge.",
+            f"That's a thoughtful inquiry regarding '{user_message}'. I'll give you a comprehensive response with practical insights.",
+            f"Great question! '{user_message}' is something many people wonder about. Here's what you should know..."
+        ]
+    elif any(word in user_lower for word in ['hello', 'hi', 'hey', 'good morning', 'good afternoon']):
+        responses = [
+            "Hello! I'm your advanced AI assistant created by Siddharth Chauhan. I'm ready to help with any questions you have. Whether it's technology, science, creative projects, or general knowledge - I'm here to provide detailed and helpful responses!",
+            "Hi there! Welcome to our conversation. I'm an AI assistant built by Siddharth Chauhan with expertise across many domains. What would you like to explore today?",
+            "Hey! Great to meet you. I'm designed by Siddharth Chauhan to provide comprehensive, accurate answers on virtually any topic. How can I assist you?"
+        ]
+    else:
+        responses = [
+            f"You've brought up '{user_message}' - that's an interesting topic! I'd be happy to provide detailed information and insights about this subject.",
+            f"Thanks for mentioning '{user_message}'. This is worth exploring in depth. Let me share what I know and help you understand this better.",
+            f"'{user_message}' is a great topic for discussion! I can provide comprehensive information, examples, and practical insights about this."
+        ]
+    return random.choice(responses)
+
 @app.route('/api/chat', methods=['POST'])
 def api_chat():
+    started = time.monotonic()
     try:
-        user_message = request.json.get('message')
+        data = request.json
+        user_message = data.get('message')
         
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
         
-        # Use Groq API for real AI responses via HTTP requests
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {GROQ_API_KEY}"
-        }
+        user_id = current_user.id if current_user.is_authenticated else None
+        context = load_chat_context(data, user_id)
+        # Only context-free prompts are interchangeable between users
+        shareable = not context.history and not context.summary
+        cache_key = chat_cache_key(user_message)
         
-        payload = {
-            "model": "llama-3.1-8b-instant",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are DevCoder AI created by Siddharth Chauhan, a specialized coding assistant. IMPORTANT CONTEXT RULES: 1) Only provide code when user asks programming-related questions (like 'write a function', 'create a website', 'build an app', 'hello world program', etc.) 2) For casual greetings ('hi', 'hello', 'how are you') respond conversationally without code 3) For general questions, provide helpful answers without unnecessary code examples 4) CODING RULES (only when code is requested): Never ask 'what language?' - choose appropriate language or provide multiple 5) For website requests, create SEPARATE files: index.html, style.css, script.js 6) CRITICAL: When creating HTML files, use these EXACT link patterns: <link rel='stylesheet' href='style.css'> for CSS and <script src='script.js'></script> for JavaScript - NO other variations! 7) For 'hello world' requests, provide code in multiple languages 8) Always suggest proper filenames 9) Keep coding responses concise - code first, brief explanation after 10) For GUI requests, create complete working code 11) Make reasonable assumptions, don't ask for clarification 12) Use proper code blocks with language tags 13) ALWAYS use standard filenames: index.html, style.css, script.js for web projects"
-                },
-                {
-                    "role": "user",
-                    "content": user_message + " (Remember: For HTML files, use href='style.css' and src='script.js' - standard relative paths only!)"
-                }
-            ],
-            "max_tokens": 2000,
-            "temperature": 0.3
-        }
+        cached = chat_cache.get(cache_key) if shareable else None
+        if cached is not None:
+            save_chat_turn(context, user_id, user_message, cached)
+            usage_ledger.record(job_owner(), 'chat', model=cached['model'], cached=True, latency_ms=elapsed_ms(started))
+            return jsonify({'response': cached['response'], 'model': cached['model'], 'cached': True,
+                            'conversation_id': context.conversation_id})
         
-        try:
-            response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=15)
-            print(f"Primary model response: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                bot_response = result['choices'][0]['message']['content'].strip()
-                print(f"Got response: {bot_response[:100]}...")
-            else:
-                print(f"Primary API error: {response.text}")
-                raise Exception(f"Primary API failed: {response.status_code}")
-                    
-        except Exception as groq_error:
-            print(f"Primary model failed: {groq_error}")
-            # Try alternative models
-            alternative_models = ["gemma2-9b-it", "mixtral-8x7b-32768", "llama3-groq-70b-8192-tool-use-preview"]
+        estimated_tokens = estimate_chat_tokens(build_chat_payload(user_message, CHAT_MODELS[0], context=context))
+        admission = chat_rate_limiter.admit(job_owner(), estimated_tokens)
+        
+        def fetch_answer():
+            # Use Groq API for real AI responses, hedging across the healthy models that have quota left
+            models = chat_rate_limiter.order(model_health.order(CHAT_MODELS), estimated_tokens)
+            payload = build_chat_payload(user_message, models[0] if models else CHAT_MODELS[0], context=context)
             
-            for alt_model in alternative_models:
-                try:
-                    print(f"Trying alternative model: {alt_model}")
-                    payload["model"] = alt_model
-                    response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=15)
-                    print(f"Alternative model {alt_model} response: {response.status_code}")
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        bot_response = result['choices'][0]['message']['content'].strip()
-                        print(f"Success with {alt_model}: {bot_response[:100]}...")
-                        break
-                    else:
-                        print(f"Model {alt_model} failed: {response.text}")
-                        continue
-                except Exception as e:
-                    print(f"Model {alt_model} exception: {e}")
-                    continue
+            try:
+                if not models:
+                    raise UpstreamError('Every model circuit is open')
+                result = llm_client.hedged_chat(payload, models, CHAT_HEDGE_DELAYS)
+                print(f"Success with {result.model}: {result.content[:100]}...")
+                if shareable:
+                    chat_cache.set(cache_key, result.content, result.model)
+                return {'response': result.content, 'model': result.model, 'usage': result.data.get('usage')}
+            except UpstreamError as groq_error:
+                if groq_error.status_code == 429:
+                    # Out of quota everywhere: ask the client to come back instead of a canned answer
+                    raise RateLimited('Every model is at its rate limit, please try again shortly',
+                                      groq_error.retry_after)
+                print(f"All API models failed, using fallback responses: {groq_error}")
+                return {'response': get_fallback_response(user_message), 'model': 'fallback'}
+        
+        try:
+            if shareable:
+                # Concurrent requests for the same prompt wait on a single upstream call
+                answer, coalesced = chat_flights.do(cache_key, fetch_answer, shared_result=lambda: chat_cache.get(cache_key))
             else:
-                print("All API models failed, using fallback responses")
-                # Enhanced intelligent fallback responses
-                import random
-                user_lower = user_message.lower()
-                bot_response = "I'm having trouble connecting to the AI models right now. Let me help you with some basic coding assistance. What programming language would you like to work with?"
-                
-                # Check for creator-related questions first
-                if any(word in user_lower for word in ['who made you', 'who created you', 'creator', 'developer', 'built you', 'siddharth', 'chauhan']):
-                    responses = [
-                        "I'm DevCoder AI, created by Siddharth Chauhan - a skilled developer who built me as a specialized coding assistant. I'm designed to help with programming tasks, code reviews, debugging, and technical solutions using Flask and AI integration.",
-                        "My creator is Siddharth Chauhan! He developed me as DevCoder AI to assist developers with coding challenges. Built with Flask and integrated with advanced AI models, I focus on providing structured code solutions and technical guidance.",
-                        "I was built by Siddharth Chauhan as DevCoder AI - your dedicated coding companion. He designed me to understand developer needs and provide practical, well-formatted code solutions with proper syntax highlighting."
-                    ]
-                elif any(word in user_lower for word in ['python', 'javascript', 'code', 'programming', 'html', 'css', 'react', 'nodejs', 'function', 'class', 'variable', 'loop', 'array', 'object']):
-                    responses = [
-                        "Let me help you with coding! Here's a practical example with proper formatting and best practices.",
-                        "Great programming question! I'll provide you with clean, well-structured code examples and explanations.",
-                        "I'll show you how to implement this with proper syntax highlighting and developer-friendly formatting."
-                    ]
-                elif any(word in user_lower for word in ['ai', 'artificial intelligence', 'machine learning', 'neural network', 'deep learning']):
-                    responses = [
-                        f"Fascinating topic! {user_message} is at the forefront of modern technology. Let me explain how it works and its real-world applications.",
-                        f"Great question about {user_message}! AI and machine learning are transforming industries. Here's a comprehensive overview...",
-                        f"I love discussing {user_message}! This field combines mathematics, computer science, and data analysis in amazing ways."
-                    ]
-                elif "?" in user_message:
-                    responses = [
-                        f"Excellent question about '{user_message}'! Let me provide you with a detailed and informative answer based on current knowledge.",
-                        f"That's a thoughtful inquiry regarding '{user_message}'. I'll give you a comprehensive response with practical insights.",
-                        f"Great question! '{user_message}' is something many people wonder about. Here's what you should know..."
-                    ]
-                elif any(word in user_lower for word in ['hello', 'hi', 'hey', 'good morning', 'good afternoon']):
-                    responses = [
-                        "Hello! I'm your advanced AI assistant created by Siddharth Chauhan. I'm ready to help with any questions you have. Whether it's technology, science, creative projects, or general knowledge - I'm here to provide detailed and helpful responses!",
-                        "Hi there! Welcome to our conversation. I'm an AI assistant built by Siddharth Chauhan with expertise across many domains. What would you like to explore today?",
-                        "Hey! Great to meet you. I'm designed by Siddharth Chauhan to provide comprehensive, accurate answers on virtually any topic. How can I assist you?"
-                    ]
-                else:
-                    responses = [
-                        f"You've brought up '{user_message}' - that's an interesting topic! I'd be happy to provide detailed information and insights about this subject.",
-                        f"Thanks for mentioning '{user_message}'. This is worth exploring in depth. Let me share what I know and help you understand this better.",
-                        f"'{user_message}' is a great topic for discussion! I can provide comprehensive information, examples, and practical insights about this."
-                    ]
-                bot_response = random.choice(responses)
-        return jsonify({'response': bot_response})
+                answer, coalesced = fetch_answer(), False
+        except RateLimited:
+            admission.settle(0)
+            raise
+        # Only the request that called upstream used tokens
+        admission.settle(0 if coalesced else (answer.get('usage') or {}).get('total_tokens'))
+        usage = {} if coalesced else answer.get('usage') or {}
+        usage_ledger.record(job_owner(), 'chat', model=answer['model'], coalesced=coalesced,
+                            prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'),
+                            total_tokens=usage.get('total_tokens'), latency_ms=elapsed_ms(started))
+        
+        save_chat_turn(context, user_id, user_message, answer)
+        response = jsonify({'response': answer['response'], 'model': answer['model'], 'cached': False,
+                            'coalesced': coalesced, 'conversation_id': context.conversation_id})
+        response.headers.update(admission.headers())
+        return response
         
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_stream_tokens(response):
+    """Yield content deltas from an OpenAI-style streaming completion"""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            break
+        chunk = json.loads(data)
+        choices = chunk.get('choices') or []
+        if choices:
+            token = choices[0].get('delta', {}).get('content')
+            if token:
+                yield token
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Stream the chat completion to the browser as Server-Sent Events.
+
+    Events: ``model`` (which model is answering), ``token`` (a content delta),
+    ``error`` (stream broke after tokens were sent) and ``done`` (carries the
+    ``conversation_id``).
+    """
+    started = time.monotonic()
+    owner = job_owner()
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message')
+    
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+    
+    user_id = current_user.id if current_user.is_authenticated else None
+    context = load_chat_context(data, user_id)
+    # Only context-free prompts are interchangeable between users
+    shareable = not context.history and not context.summary
+    cache_key = chat_cache_key(user_message)
+    # Tokens this request spent upstream, for the rate limiter and the usage ledger;
+    # stays empty for cached and shared answers
+    spent = {}
+    admission = None
+    
+    def charge(answer):
+        # Streams don't report usage, so settle with an estimate of what was generated
+        spent.update(prompt_tokens=admission.estimated_tokens - EXPECTED_COMPLETION_TOKENS,
+                     completion_tokens=estimate_tokens(answer))
+        spent['total_tokens'] = spent['prompt_tokens'] + spent['completion_tokens']
+        admission.settle(spent['total_tokens'])
+    
+    def cached_events(answer):
+        yield 'model', {'model': answer['model'], 'cached': True}
+        yield 'token', {'content': answer['response']}
+        yield 'done', {'model': answer['model'], 'cached': True}
+    
+    def upstream_events():
+        # Like /api/chat: rate limited only if every model was out of quota or answered 429;
+        # no models (every circuit open) or any other failure gets the fallback answer
+        rate_limited = False
+        failed = False
+        for model in models:
+            if not llm_client.available(model):
+                rate_limited = True
+                continue
+            sent_tokens = False
+            started = time.monotonic()
+            try:
+                payload = build_chat_payload(user_message, model, stream=True, context=context)
+                with llm_client.stream_chat(payload) as response:
+                    print(f"Streaming model {model} response: {response.status_code}")
+                    llm_client.observe(model, response)
+                    if response.status_code != 200:
+                        print(f"Model {model} failed: {response.text}")
+                        llm_client.record(model, False, response.status_code, time.monotonic() - started)
+                        if response.status_code == 429:
+                            rate_limited = True
+                        else:
+                            failed = True
+                        continue
+                    
+                    yield 'model', {'model': model}
+                    tokens = []
+                    for token in iter_stream_tokens(response):
+                        sent_tokens = True
+                        tokens.append(token)
+                        yield 'token', {'content': token}
+                    llm_client.record(model, True, 200, time.monotonic() - started)
+                    answer = ''.join(tokens).strip()
+                    if tokens and shareable:
+                        chat_cache.set(cache_key, answer, model)
+                    charge(answer)
+                    yield 'done', {'model': model}
+                    return
+            except Exception as e:
+                print(f"Streaming model {model} exception: {e}")
+                llm_client.record(model, False, latency=time.monotonic() - started)
+                failed = True
+                if sent_tokens:
+                    # The client already rendered part of this answer, so don't
+                    # splice another model's output onto it
+                    charge(''.join(tokens))
+                    yield 'error', {'error': 'The response stream was interrupted'}
+                    yield 'done', {'model': model}
+                    return
+        
+        if rate_limited and not failed:
+            # Out of quota everywhere: ask the client to come back instead of a canned answer
+            admission.settle(0)
+            yield 'error', {'error': 'Every model is at its rate limit, please try again shortly'}
+            yield 'done', {'model': None}
+            return
+        print("All API models failed, using fallback responses")
+        admission.settle(0)
+        yield 'model', {'model': 'fallback'}
+        yield 'token', {'content': get_fallback_response(user_message)}
+        yield 'done', {'model': 'fallback'}
+    
+    def shared_events():
+        # Another worker may already be streaming this prompt; if so, wait for its answer
+        with chat_flights.peer_lease(cache_key, lambda: chat_cache.get(cache_key)) as peer_answer:
+            if peer_answer is not None:
+                admission.settle(0)
+                yield from cached_events(peer_answer)
+            else:
+                yield from upstream_events()
+    
+    def relay(events):
+        # Format events for this client, remember the finished turn and record its usage
+        parts = []
+        interrupted = False
+        for event, payload in events:
+            if event == 'token':
+                parts.append(payload['content'])
+            elif event == 'error':
+                interrupted = True
+            elif event == 'done':
+                if admission is not None:
+                    # Requests that shared another's stream spent nothing; the one that ran it has already settled
+                    admission.settle(spent.get('total_tokens', 0))
+                payload = dict(payload, conversation_id=context.conversation_id)
+                if parts and not interrupted:
+                    save_chat_turn(context, user_id, user_message,
+                                   {'response': ''.join(parts).strip(), 'model': payload['model']})
+                usage_ledger.record(owner, 'chat', model=payload['model'], cached=payload.get('cached'),
+                                    success=not interrupted, estimated=bool(spent) or None,
+                                    latency_ms=elapsed_ms(started), **spent)
+            yield sse_event(event, payload)
+    
+    headers = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    }
+    cached = chat_cache.get(cache_key) if shareable else None
+    if cached is not None:
+        events = cached_events(cached)
+    else:
+        # Admit before the stream starts, so a limited request still gets a proper 429
+        try:
+            estimated_tokens = estimate_chat_tokens(build_chat_payload(user_message, CHAT_MODELS[0], context=context))
+            admission = chat_rate_limiter.admit(job_owner(), estimated_tokens)
+            try:
+                models = chat_rate_limiter.order(model_health.order(CHAT_MODELS), estimated_tokens)
+            except RateLimited:
+                admission.settle(0)
+                raise
+        except RateLimited as e:
+            return rate_limited_response(e)
+        headers.update(admission.headers())
+        if shareable:
+            # Concurrent requests for the same prompt all read one upstream stream
+            events = chat_flights.stream(cache_key, shared_events)
+        else:
+            events = upstream_events()
+    
+    return Response(stream_with_context(relay(events)), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/conversations', methods=['GET'])
+@login_required
+def list_conversations():
+    try:
+        return jsonify({'conversations': conversation_store.list_recent(current_user.id)})
+    except PyMongoError as e:
+        return jsonify({'error': f'Failed to load conversations: {str(e)}'}), 500
+
+@app.route('/api/chat/cache', methods=['GET'])
+@login_required
+def chat_cache_stats():
+    stats = chat_cache.stats()
+    stats['coalescing'] = chat_flights.stats()
+    return jsonify(stats)
+
+@app.route('/api/chat/limits', methods=['GET'])
+@login_required
+def chat_limit_stats():
+    return jsonify(chat_rate_limiter.stats())
+
+@app.route('/api/usage', methods=['GET'])
+@login_required
+def usage_stats():
+    """The user's daily usage rollups, plus this worker's ledger counters"""
+    try:
+        period = max(1, min(request.args.get('days', USAGE_DASHBOARD_DAYS, type=int), 90))
+        days = usage_ledger.daily(current_user.id, days=period)
+    except PyMongoError as e:
+        return jsonify({'error': f'Failed to load usage: {str(e)}'}), 500
+    return jsonify({'days': days, 'totals': sum_rollups(days), 'ledger': usage_ledger.stats()})
+
 @app.route('/create_file', methods=['POST'])
 def create_file():
     try:
@@ -377,207 +857,301 @@ def create_file():
         if not filename or not content:
             return jsonify({'error': 'Filename and content are required'}), 400
         
-        # Create generated_code directory if it doesn't exist
-        code_dir = os.path.join(os.getcwd(), 'generated_code')
-        if not os.path.exists(code_dir):
-            os.makedirs(code_dir)
-        
-        # Add appropriate file extension based on language
-        extensions = {
-            'python': '.py',
-            'javascript': '.js',
-            'java': '.java',
-            'cpp': '.cpp',
-            'c++': '.cpp',
-            'html': '.html',
-            'css': '.css',
-            'sql': '.sql',
-            'php': '.php',
-            'ruby': '.rb',
-            'go': '.go',
-            'rust': '.rs',
-            'typescript': '.ts'
-        }
-        
         # Add extension if not present
-        if language.lower() in extensions and not filename.endswith(extensions[language.lower()]):
-            filename += extensions[language.lower()]
-        
-        file_path = os.path.join(code_dir, filename)
-        
-        # Write content to file
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        filename = with_extension(filename, language)
+        save_generated_files([{'filename': filename, 'content': content}])
         
         return jsonify({
             'success': True,
             'response': 'File created successfully: ' + filename,
-            'path': file_path
+            'path': url_for('serve_generated_file', filename=filename)
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to create file: {str(e)}'}), 500
-@app.route('/execute', methods=['POST'])
-@login_required
-def execute_code():
-    data = request.get_json()
-    code = data.get('code', '')
-    language = data.get('language', 'javascript')
+
+@app.route('/create_files', methods=['POST'])
+def create_files():
+    """Write a whole project in one request.
+
+    Takes ``files`` ([{filename, content, language}]) or ``response``, a raw
+    model answer whose fenced code blocks become index.html, style.css, ...
+    """
+    try:
+        data = request.json or {}
+        if data.get('files'):
+            files = [{'filename': with_extension(f.get('filename') or '', f.get('language')),
+                      'content': f.get('content') or ''} for f in data['files']]
+        elif data.get('response'):
+            files = extract_files(data['response'])
+        else:
+            return jsonify({'error': 'Provide files or a response with code blocks'}), 400
+        if not files:
+            return jsonify({'error': 'No code blocks found in the response'}), 400
+        
+        names = save_generated_files(files)
+        html_files = [name for name in names if name.endswith('.html')]
+        preview = 'index.html' if 'index.html' in html_files else (html_files[0] if html_files else None)
+        
+        return jsonify({
+            'success': True,
+            'files': names,
+            'preview_url': url_for('preview_file', filename=preview) if preview else None
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Failed to create files: {str(e)}'}), 500
+
+def workspace_namespace():
+    """Workspace the request reads and writes: the user's own, or one per browser session when logged out"""
+    if current_user.is_authenticated:
+        return current_user.id
+    # Not the client address: visitors behind one proxy or NAT would share (and overwrite) a workspace
+    if 'workspace_id' not in session:
+        session['workspace_id'] = uuid.uuid4().hex
+    return 'anon-session:' + session['workspace_id']
+
+def save_generated_files(files):
+    """Save files into the user's workspace all-or-nothing; returns their names"""
+    owner = current_user.id if current_user.is_authenticated else None
+    return workspaces.put(workspace_namespace(), files, owner)
+
+def run_java_snippet(code, timeout, on_output=None):
+    """Compile (or reuse the cached build of) a Main class and run it; returns an ExecutionResult"""
+    class_dir, compile_error = compile_cache.get_or_compile('java', code, timeout)
+    if compile_error is not None:
+        return compile_error
     
-    if not code:
-        return jsonify({'error': 'No code provided'}), 400
+    if sandbox_pools['java'].available:
+        # Run inside the warm JVM
+        return sandbox_pools['java'].execute_compiled(class_dir, timeout)
     
+    # No warm JVM (e.g. still starting up): run from scratch
+    return run_command(['java', f'-Xmx{execution_limits.memory_bytes // (1024 * 1024)}m', '-cp', class_dir, 'Main'],
+                       timeout, on_output, limits=rlimits(execution_limits, address_space=False, nproc=False))
+
+def job_output_writer(output):
+    """``on_output`` callback that forwards sandbox output to a job's live output"""
+    if output is None:
+        return None
+    return lambda stream, text: output.write(text, stream)
+
+def run_snippet(code, language, output=None):
+    """Run a snippet in the sandbox; returns the /execute result dict.
+
+    Output is also written to ``output`` (a job's live output) as it is produced.
+    """
+    on_output = job_output_writer(output)
     try:
         if language == 'javascript':
-            # Execute JavaScript using Node.js
-            import subprocess
-            import tempfile
-            import os
-            
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
-            
+            # Execute JavaScript on a pre-started Node.js worker
             try:
-                # Execute with Node.js
-                result = subprocess.run(['node', temp_file], 
-                                      capture_output=True, 
-                                      text=True, 
-                                      timeout=10)
-                
-                output = result.stdout
-                error = result.stderr
-                
-                return jsonify({
-                    'output': output,
-                    'error': error,
-                    'success': result.returncode == 0
-                })
-                
+                result = sandbox_pools['javascript'].execute(code, EXECUTION_TIMEOUT, on_output)
             except FileNotFoundError:
-                return jsonify({
+                return {
                     'output': '',
                     'error': 'Node.js not installed. Please install Node.js to run JavaScript.',
                     'success': False
-                })
-            finally:
-                os.unlink(temp_file)
+                }
                 
         elif language == 'python':
-            # Execute Python code
-            import subprocess
-            import tempfile
-            import os
-            
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
-            
-            try:
-                # Execute with Python
-                result = subprocess.run(['python', temp_file], 
-                                      capture_output=True, 
-                                      text=True, 
-                                      timeout=10)
-                
-                output = result.stdout
-                error = result.stderr
-                
-                return jsonify({
-                    'output': output,
-                    'error': error,
-                    'success': result.returncode == 0
-                })
-                
-            finally:
-                os.unlink(temp_file)
+            # Execute Python code on the warm fork server
+            result = sandbox_pools['python'].execute(code, EXECUTION_TIMEOUT, on_output)
                 
-        elif language == 'java':
+        else:
             # Execute Java code
-            import subprocess
-            import tempfile
-            import os
-            
-            # Create temporary directory
-            temp_dir = tempfile.mkdtemp()
-            java_file = os.path.join(temp_dir, 'Main.java')
-            
-            # Write Java code
-            with open(java_file, 'w') as f:
-                f.write(code)
-            
             try:
-                # Compile Java
-                compile_result = subprocess.run(['javac', java_file], 
-                                             capture_output=True, 
-                                             text=True, 
-                                             timeout=10)
-                
-                if compile_result.returncode != 0:
-                    return jsonify({
-                        'output': '',
-                        'error': compile_result.stderr,
-                        'success': False
-                    })
-                
-                # Run Java
-                class_file = os.path.join(temp_dir, 'Main')
-                run_result = subprocess.run(['java', '-cp', temp_dir, 'Main'], 
-                                         capture_output=True, 
-                                         text=True, 
-                                         timeout=10)
-                
-                return jsonify({
-                    'output': run_result.stdout,
-                    'error': run_result.stderr,
-                    'success': run_result.returncode == 0
-                })
-                
+                result = run_java_snippet(code, EXECUTION_TIMEOUT, on_output)
             except FileNotFoundError:
-                return jsonify({
+                return {
                     'output': '',
                     'error': 'Java not installed. Please install Java JDK to run Java code.',
                     'success': False
-                })
-            finally:
-                # Clean up
-                import shutil
-                shutil.rmtree(temp_dir)
+                }
         
-        else:
-            return jsonify({'error': f'Language {language} not supported'}), 400
+        if result.timed_out:
+            raise subprocess.TimeoutExpired(language, EXECUTION_TIMEOUT)
+        
+        return {
+            'output': truncate_output(result.stdout, job_queue.output_limit),
+            'error': truncate_output(result.stderr, job_queue.output_limit),
+            'success': result.returncode == 0,
+            'usage': result.usage
+        }
             
     except subprocess.TimeoutExpired:
-        return jsonify({
+        return {
             'output': '',
-            'error': 'Code execution timed out (10 seconds limit)',
+            'error': f'Code execution timed out ({EXECUTION_TIMEOUT} seconds limit)',
             'success': False
-        })
+        }
     except Exception as e:
-        return jsonify({
+        return {
             'output': '',
             'error': f'Execution error: {str(e)}',
             'success': False
-        })
+        }
+
+def job_owner():
+    """Fairness and visibility key for jobs: the user, or the client address when logged out"""
+    if current_user.is_authenticated:
+        return current_user.id
+    return 'anon:' + (request.remote_addr or '')
+
+def submit_job(kind, fn):
+    """Queue a job and answer 202 with where to find its result"""
+    try:
+        job_id = job_queue.submit(job_owner(), kind, fn)
+    except QueueFull as e:
+        return jsonify({'error': str(e), 'success': False}), 429
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('job_status', job_id=job_id),
+        'events_url': url_for('job_events', job_id=job_id)
+    }), 202
+
+@app.route('/execute', methods=['POST'])
+@login_required
+def execute_code():
+    data = request.get_json()
+    code = data.get('code', '')
+    language = data.get('language', 'javascript')
+    
+    if not code:
+        return jsonify({'error': 'No code provided'}), 400
+    if language not in ('javascript', 'python', 'java'):
+        return jsonify({'error': f'Language {language} not supported'}), 400
+    
+    started = time.monotonic()
+    owner = job_owner()
+    cache_key = None
+    if data.get('cache'):
+        # /execute has no stdin yet, so every run is keyed with an empty one
+        cache_key = execution_cache.lookup_key(language, code, '', sandbox_pools[language].runtime_version())
+        cached = execution_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            usage_ledger.record(owner, 'execute', language=language, cached=True, latency_ms=elapsed_ms(started))
+            return jsonify(dict(cached, cached=True))
+    
+    def run(output):
+        result = run_snippet(code, language, output)
+        if cache_key:
+            execution_cache.set(cache_key, result)
+        # Latency includes the time spent queued
+        usage_ledger.record(owner, 'execute', language=language, success=result['success'],
+                            cpu_ms=(result.get('usage') or {}).get('cpu_ms'), latency_ms=elapsed_ms(started))
+        return result
+    
+    return submit_job('execute', run)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status and result; with ?since=<seq>, also the output written after that chunk"""
+    job = job_queue.get(job_id, job_owner())
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    since = request.args.get('since', type=int)
+    if since is not None:
+        job['output'] = job_queue.output(job_id, since)
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent status updates and live output for a job, ending with its result"""
+    owner = job_owner()
+    if job_queue.get(job_id, owner) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        status = None
+        seq = 0
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        while time.monotonic() < deadline:
+            job = job_queue.get(job_id, owner)
+            if job is None:
+                break
+            for chunk in job_queue.output(job_id, seq):
+                seq = chunk['seq']
+                yield sse_event('output', {'stream': chunk['stream'], 'data': chunk['data']})
+            if job['status'] != status:
+                status = job['status']
+                yield sse_event('status', {'status': status})
+            if 'result' in job:
+                yield sse_event('result', job['result'])
+                return
+            time.sleep(0.1)
+        yield sse_event('error', {'error': 'Job result is not available yet, poll the status URL'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs', methods=['GET'])
+@login_required
+def job_queue_stats():
+    return jsonify(job_queue.stats())
+
+@app.route('/execute/cache', methods=['GET'])
+@login_required
+def execution_cache_stats():
+    return jsonify(execution_cache.stats())
+
+@app.route('/export_files', methods=['GET'])
+def export_files():
+    """Download the workspace, or the files named by repeated ?files=, as a zip: ?files=&name="""
+    try:
+        names = request.args.getlist('files') or None
+        try:
+            entries = workspaces.entries(workspace_namespace(), names)
+        except FileNotFoundError as e:
+            return jsonify({'error': f'File not found: {e}'}), 404
+        if not entries:
+            return jsonify({'error': 'No files to export'}), 404
+        
+        name = re.sub(r'[^\w.-]', '_', request.args.get('name') or 'project')
+        return project_exporter.send(entries, name if name.endswith('.zip') else name + '.zip')
+    except Exception as e:
+        return jsonify({'error': f'Failed to export files: {str(e)}'}), 500
+
+@app.route('/workspace/stats', methods=['GET'])
+@login_required
+def workspace_stats():
+    return jsonify(workspaces.stats())
 
 @app.route('/list_files', methods=['GET'])
 def list_files():
+    """Paginated file listing: ?scope=workspace|shared&limit=&sort=name|mtime|size|language&order=asc|desc&language=&prefix=&cursor=
+
+    ``workspace`` (the default) lists the user's own files, ``shared`` the legacy generated_code/ directory.
+    """
     try:
-        code_dir = os.path.join(os.getcwd(), 'generated_code')
-        if not os.path.exists(code_dir):
-            os.makedirs(code_dir)
-        files = []
-        generated_dir = 'generated_code'
-        if os.path.exists(generated_dir):
-            for filename in os.listdir(generated_dir):
-                if os.path.isfile(os.path.join(generated_dir, filename)):
-                    files.append(filename)
-        
-        return jsonify({'files': files})
+        options = dict(
+            limit=max(1, min(request.args.get('limit', 100, type=int), 500)),
+            sort=request.args.get('sort', 'name'),
+            descending=request.args.get('order', 'asc') == 'desc',
+            language=request.args.get('language'),
+            prefix=request.args.get('prefix'),
+            cursor=request.args.get('cursor')
+        )
+        if request.args.get('scope', 'workspace') == 'shared':
+            file_catalog.reconcile()
+            items, next_cursor = file_catalog.list(**options)
+        else:
+            items, next_cursor = workspaces.list(workspace_namespace(), **options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to list files: {str(e)}'}), 500
+    
+    return jsonify({
+        'files': [item['name'] for item in items],
+        'items': items,
+        'next_cursor': next_cursor
+    })
 
 
 @app.route('/terminal', methods=['POST'])
@@ -594,53 +1168,48 @@ def terminal_command():
     if any(dangerous in command.lower() for dangerous in dangerous_commands):
         return jsonify({'error': 'Command blocked for security reasons', 'success': False})
     
+    return submit_job('terminal', lambda output: run_terminal_command(command, output))
+
+def run_terminal_command(command, output=None):
+    """Run a shell command from the project directory; returns the /terminal result dict.
+
+    stdout and stderr are interleaved as a terminal shows them, and also written
+    to ``output`` (a job's live output) as they are produced.
+    """
     try:
-        import subprocess
-        import os
-        
         # Change to project directory for commands
         project_dir = os.path.dirname(os.path.abspath(__file__))
         
         # Execute command
-        result = subprocess.run(
+        result = run_command(
             command,
+            60,  # 60 second timeout
+            job_output_writer(output),
+            merge_stderr=True,
             shell=True,
-            capture_output=True,
-            text=True,
-            timeout=60,  # 60 second timeout
             cwd=project_dir
         )
         
-        output = result.stdout
-        error = result.stderr
-        
-        # Combine output and error for display
-        full_output = ""
-        if output:
-            full_output += output
-        if error:
-            if full_output:
-                full_output += "\n"
-            full_output += error
+        if result.timed_out:
+            return {
+                'error': 'Command timed out (60 seconds limit)',
+                'success': False
+            }
         
-        return jsonify({
-            'output': full_output,
+        return {
+            'output': truncate_output(result.stdout, job_queue.output_limit),
             'success': result.returncode == 0,
             'return_code': result.returncode
-        })
+        }
         
-    except subprocess.TimeoutExpired:
-        return jsonify({
-            'error': 'Command timed out (60 seconds limit)',
-            'success': False
-        })
     except Exception as e:
-        return jsonify({
+        return {
             'output': '',
             'error': f'Error executing command: {str(e)}',
             'success': False
-        })
+        }
 
 if __name__ == '__main__':
+    user_store.ensure_indexes()
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,173 @@
+"""Login/signup throughput against an in-memory stand-in for MongoDB.
+
+Signs up ``--users`` accounts, then fires ``--requests`` logins from
+``--concurrency`` threads through the Flask test client while a probe
+thread keeps requesting the landing page. Every request uses a fresh,
+logged-out client, so each login really checks a password. Reports auth
+requests per second, latency percentiles, how many logins were turned
+away with 503, and how the landing page's latency held up during the
+burst. Any other response (a redirect, a failed login) aborts the run.
+
+    python benchmarks/auth_bench.py --users 20 --requests 200 --concurrency 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOCAL_STORE_PATH', os.path.join(tempfile.mkdtemp(prefix='auth-bench-'), 'store.sqlite3'))
+
+from bson import ObjectId  # noqa: E402
+from pymongo.errors import DuplicateKeyError  # noqa: E402
+
+
+class MemoryCollection:
+    """Just enough of a pymongo collection for the users store"""
+
+    def __init__(self):
+        self.docs = {}
+        self.unique = []
+        self.lock = threading.Lock()
+
+    def create_index(self, field, unique=False):
+        if unique and field not in self.unique:
+            self.unique.append(field)
+        return f'{field}_1'
+
+    def _matches(self, doc, query):
+        return all(doc.get(key) == value for key, value in query.items())
+
+    def find_one(self, query, projection=None):
+        with self.lock:
+            doc = next((doc for doc in self.docs.values() if self._matches(doc, query)), None)
+        if doc is None or projection is None:
+            return dict(doc) if doc else None
+        return {key: value for key, value in doc.items() if key in projection}
+
+    def insert_one(self, doc):
+        with self.lock:
+            for field in self.unique:
+                if any(existing.get(field) == doc.get(field) for existing in self.docs.values()):
+                    raise DuplicateKeyError(f'E11000 duplicate key error index: {field}_1', 11000,
+                                            {'keyPattern': {field: 1}, 'keyValue': {field: doc.get(field)}})
+            doc.setdefault('_id', ObjectId())
+            self.docs[doc['_id']] = dict(doc)
+
+    def update_one(self, query, update):
+        with self.lock:
+            for doc in self.docs.values():
+                if self._matches(doc, query):
+                    doc.update(update.get('$set', {}))
+                    return
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, help='bcrypt cost (default: calibrated)')
+    args = parser.parse_args()
+
+    if args.rounds:
+        os.environ['BCRYPT_ROUNDS'] = str(args.rounds)
+    import app as devcoder
+
+    collection = MemoryCollection()
+    devcoder.users_collection = collection
+    devcoder.user_store.collection = collection
+    # What a gunicorn worker does when it boots
+    devcoder.user_store.ensure_indexes()
+    print(f"bcrypt cost {devcoder.password_hasher.rounds}, {devcoder.password_hasher.workers} hashing threads, "
+          f"{devcoder.password_hasher.max_pending} pending max")
+
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def post(url, body):
+        # A new client has no session cookie, so /login can't short-circuit to a redirect
+        client = devcoder.app.test_client()
+        started = time.perf_counter()
+        response = client.post(url, json=body)
+        elapsed = time.perf_counter() - started
+        accepted = response.status_code == 200 and (response.get_json(silent=True) or {}).get('success') is True
+        if not accepted and response.status_code != 503:
+            raise SystemExit(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        with lock:
+            statuses[(url, response.status_code)] += 1
+            if accepted:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    for i in range(args.users):
+        post('/signup', {'username': f'user{i}', 'email': f'user{i}@example.com', 'password': f'secret{i}'})
+    signup_seconds = time.perf_counter() - started
+    print(f"signup: {args.users} in {signup_seconds:.2f}s ({args.users / signup_seconds:.1f}/s)")
+    latencies.clear()
+
+    stop = threading.Event()
+    probe_latencies = []
+
+    def probe():
+        probe_client = devcoder.app.test_client()
+        while not stop.is_set():
+            t = time.perf_counter()
+            probe_client.get('/')
+            probe_latencies.append(time.perf_counter() - t)
+            time.sleep(0.01)
+
+    remaining = iter(range(args.requests))
+
+    failures = []
+
+    def worker():
+        while True:
+            with lock:
+                i = next(remaining, None)
+            if i is None:
+                return
+            n = i % args.users
+            try:
+                post('/login', {'username': f'user{n}', 'password': f'secret{n}'})
+            except SystemExit as e:
+                failures.append(e)
+                return
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe_thread.join()
+    if failures:
+        raise failures[0]
+
+    ok = statuses[('/login', 200)]
+    busy = statuses[('/login', 503)]
+    print(f"login: {args.requests} requests in {elapsed:.2f}s, {ok / elapsed:.1f} accepted/s, "
+          f"{busy} rejected with 503")
+    print(f"login latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"landing page during burst: p50 {percentile(probe_latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {percentile(probe_latencies, 0.99) * 1000:.1f} ms over {len(probe_latencies)} requests")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Response cache for /api/chat.
+
+Keys are built from the normalized user message plus everything else that
+shapes the answer (model, temperature, system prompt version), so "Hello
+world in Python!" and "hello world in python" share one entry. Lookups hit
+an in-process LRU first and, when enabled, a shared tier in the host-local
+store so every gunicorn worker benefits from another worker's answer.
+"""
+import hashlib
+import json
+import re
+import time
+import unicodedata
+
+from ttl_cache import TTLCache
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a prompt"""
+    message = unicodedata.normalize('NFKC', message).lower()
+    message = _WHITESPACE.sub(' ', message).strip()
+    return message.rstrip(' .!?')
+
+
+def prompt_version(system_prompt):
+    """Short fingerprint of the system prompt so edits invalidate old answers"""
+    return hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def make_key(message, model, temperature, system_prompt_version):
+    raw = json.dumps([normalize_message(message), model, temperature, system_prompt_version])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ChatResponseCache:
+    def __init__(self, ttl=3600, max_entries=1000, max_bytes=8 * 1024 * 1024,
+                 store=None, shared_max_entries=10000):
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes,
+                               sizeof=lambda value: len(value['response']))
+        # Optional LocalStore for the cross-worker tier
+        self.store = store
+        self.shared_max_entries = shared_max_entries
+        self.shared_hits = 0
+        self._writes = 0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('chat_cache', [
+            '''CREATE TABLE IF NOT EXISTS chat_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )''',
+            'CREATE INDEX IF NOT EXISTS chat_cache_accessed ON chat_cache (accessed_at)'
+        ])
+
+    def get(self, key):
+        """Cached ``{'response', 'model'}`` dict for ``key``, or None"""
+        value = self.memory.get(key)
+        if value is not None or self.store is None:
+            return value
+
+        try:
+            self._ensure_schema()
+            now = time.time()
+            row = self.store.execute('SELECT value, expires_at FROM chat_cache WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            self.store.execute('UPDATE chat_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        except Exception as e:
+            print(f"Shared chat cache read failed: {e}")
+            return None
+
+        value = json.loads(row[0])
+        self.shared_hits += 1
+        # Promote into this worker's LRU for the remaining lifetime
+        self.memory.set(key, value, ttl=row[1] - now)
+        return value
+
+    def set(self, key, response, model):
+        value = {'response': response, 'model': model}
+        self.memory.set(key, value)
+        if self.store is None:
+            return
+
+        try:
+            self._ensure_schema()
+            now = time.time()
+            self.store.execute('INSERT OR REPLACE INTO chat_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                               (key, json.dumps(value), now + self.ttl, now))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune(now)
+        except Exception as e:
+            print(f"Shared chat cache write failed: {e}")
+
+    def _prune(self, now):
+        self.store.execute('DELETE FROM chat_cache WHERE expires_at <= ?', (now,))
+        self.store.execute(
+            '''DELETE FROM chat_cache WHERE key IN (
+                   SELECT key FROM chat_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)''',
+            (self.shared_max_entries,))
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['shared_enabled'] = self.store is not None
+        stats['shared_hits'] = self.shared_hits
+        return stats
@@ -0,0 +1,158 @@
+"""On-disk cache of compiled snippets for /execute.
+
+Compiled output is stored under ``<root>/<language>/<key>/`` where the key
+hashes the language, the toolchain version and the source, so clicking Run
+again on unchanged code skips the compiler entirely. Entries are published
+with an atomic rename and evicted least-recently-used once the cache grows
+past ``max_bytes``.
+
+Each compiled language is a toolchain registered with ``register``. Java is
+the only one /execute runs today; C++, Go or Rust plug in the same way, e.g.
+``CommandToolchain('main.cpp', ['g++', '-O2', '-o', '{out}/main', '{src}'],
+['g++', '--version'])``.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from sandbox_pool import ExecutionResult
+
+MARKER = '.complete'
+
+
+class CommandToolchain:
+    """Compiles ``source_name`` with an external command.
+
+    ``{src}`` and ``{out}`` in ``compile_argv`` are replaced with the source
+    file and the output directory.
+    """
+
+    def __init__(self, source_name, compile_argv, version_argv):
+        self.source_name = source_name
+        self.compile_argv = compile_argv
+        self.version_argv = version_argv
+        self._version = None
+
+    def version(self):
+        if self._version is None:
+            result = subprocess.run(self.version_argv, capture_output=True, text=True, timeout=30)
+            self._version = (result.stdout + result.stderr).strip()
+        return self._version
+
+    def compile(self, directory, timeout):
+        source = os.path.join(directory, self.source_name)
+        argv = [arg.replace('{src}', source).replace('{out}', directory) for arg in self.compile_argv]
+        result = subprocess.run(argv, capture_output=True, text=True, timeout=timeout)
+        return ExecutionResult(result.stdout, result.stderr, result.returncode, False)
+
+
+class JavaToolchain(CommandToolchain):
+    """javac, or the warm JVM's in-process compiler when its pool is up"""
+
+    def __init__(self, java_pool=None):
+        super().__init__('Main.java', ['javac', '-d', '{out}', '{src}'], ['javac', '-version'])
+        self.java_pool = java_pool
+
+    def compile(self, directory, timeout):
+        if self.java_pool is not None and self.java_pool.available:
+            return self.java_pool.compile(directory, timeout)
+        return super().compile(directory, timeout)
+
+
+class CompileCache:
+    def __init__(self, root, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.toolchains = {}
+        self.hits = 0
+        self.misses = 0
+        self._evict_lock = threading.Lock()
+
+    def register(self, language, toolchain):
+        self.toolchains[language] = toolchain
+
+    def key(self, language, source):
+        toolchain = self.toolchains[language]
+        digest = hashlib.sha256()
+        for part in (language, toolchain.version(), source):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get_or_compile(self, language, source, timeout):
+        """Return ``(directory, None)`` with the compiled output, or ``(None, result)`` on a compile error"""
+        toolchain = self.toolchains[language]
+        entry = os.path.join(self.root, language, self.key(language, source))
+        marker = os.path.join(entry, MARKER)
+
+        if os.path.exists(marker):
+            self.hits += 1
+            # Refresh the entry's position in the LRU order
+            os.utime(marker)
+            return entry, None
+
+        self.misses += 1
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.staging-')
+        try:
+            with open(os.path.join(staging, toolchain.source_name), 'w') as f:
+                f.write(source)
+            result = toolchain.compile(staging, timeout)
+            if result.timed_out or result.returncode != 0:
+                return None, result
+
+            size = sum(os.path.getsize(os.path.join(dirpath, name))
+                       for dirpath, _, names in os.walk(staging) for name in names)
+            with open(os.path.join(staging, MARKER), 'w') as f:
+                json.dump({'size': size}, f)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # Another worker published the same entry first; use theirs
+                pass
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self._evict()
+        return entry, None
+
+    def _evict(self):
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            entries = []
+            total = 0
+            for language in os.listdir(self.root):
+                language_dir = os.path.join(self.root, language)
+                if not os.path.isdir(language_dir):
+                    continue
+                for name in os.listdir(language_dir):
+                    marker = os.path.join(language_dir, name, MARKER)
+                    try:
+                        with open(marker) as f:
+                            size = json.load(f)['size']
+                        mtime = os.path.getmtime(marker)
+                    except (OSError, ValueError, KeyError):
+                        continue
+                    entries.append((mtime, size, os.path.join(language_dir, name)))
+                    total += size
+
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+        finally:
+            self._evict_lock.release()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
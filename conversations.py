@@ -0,0 +1,160 @@
+"""Per-user chat conversations stored in MongoDB.
+
+Each conversation is one document holding its most recent messages (capped
+with ``$push``/``$slice``), a running message count and a rolling summary
+of turns that no longer fit the context budget. Requests load the summary
+plus a bounded window of recent messages with a projected, indexed query,
+so prompt size and lookup cost stay flat as a conversation grows.
+"""
+import re
+import threading
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+_CODE_BLOCK = re.compile(r'```.*?(```|$)', re.DOTALL)
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English and code, plus per-message overhead
+    return len(text) // 4 + 4
+
+
+def summarize_turn(message, limit=160):
+    """One-line extractive summary of a message, with code blocks elided"""
+    text = _CODE_BLOCK.sub('[code]', message['content'])
+    text = ' '.join(text.split())
+    if len(text) > limit:
+        text = text[:limit - 3].rstrip() + '...'
+    speaker = 'User' if message['role'] == 'user' else 'Assistant'
+    return f"{speaker}: {text}"
+
+
+class ConversationStore:
+    def __init__(self, collection, token_budget=3000, summary_budget=400,
+                 max_recent_messages=20, max_stored_messages=200):
+        self.collection = collection
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_recent_messages = max_recent_messages
+        self.max_stored_messages = max_stored_messages
+        self._indexes_ready = False
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        # Created lazily so app startup doesn't block on MongoDB
+        if self._indexes_ready:
+            return
+        with self._lock:
+            if not self._indexes_ready:
+                self.collection.create_index([('user_id', 1), ('updated_at', -1)])
+                self._indexes_ready = True
+
+    @staticmethod
+    def _object_id(conversation_id):
+        try:
+            return ObjectId(conversation_id)
+        except (InvalidId, TypeError):
+            return None
+
+    def create(self, user_id, title):
+        self.ensure_indexes()
+        now = datetime.utcnow()
+        result = self.collection.insert_one({
+            'user_id': user_id,
+            'title': title[:80],
+            'messages': [],
+            'message_count': 0,
+            'summary': '',
+            'summarized_count': 0,
+            'created_at': now,
+            'updated_at': now
+        })
+        return str(result.inserted_id)
+
+    def load(self, conversation_id, user_id):
+        """Summary and recent-message window of a conversation, or None if it isn't the user's"""
+        object_id = self._object_id(conversation_id)
+        if object_id is None:
+            return None
+        self.ensure_indexes()
+        # Two messages beyond the context window, so a message is always folded
+        # into the summary before it can drop out of what we load
+        return self.collection.find_one(
+            {'_id': object_id, 'user_id': user_id},
+            {'summary': 1, 'summarized_count': 1, 'message_count': 1,
+             'messages': {'$slice': -(self.max_recent_messages + 2)}}
+        )
+
+    def list_recent(self, user_id, limit=20):
+        self.ensure_indexes()
+        cursor = self.collection.find(
+            {'user_id': user_id},
+            {'title': 1, 'updated_at': 1, 'message_count': 1}
+        ).sort('updated_at', -1).limit(limit)
+        return [{
+            'id': str(doc['_id']),
+            'title': doc.get('title', ''),
+            'message_count': doc.get('message_count', 0),
+            'updated_at': doc['updated_at'].isoformat() + 'Z'
+        } for doc in cursor]
+
+    def build_context(self, conversation):
+        """Return ``(history, summary, new_summarized_count)`` for the next prompt.
+
+        ``history`` is the longest run of recent messages that fits the token
+        budget (after the summary). Loaded messages that didn't make it and
+        aren't summarized yet are folded into the rolling summary.
+        """
+        messages = conversation.get('messages', [])
+        summary = conversation.get('summary', '')
+        summarized_count = conversation.get('summarized_count', 0)
+        first_index = conversation.get('message_count', len(messages)) - len(messages)
+
+        budget = self.token_budget - estimate_tokens(summary)
+        keep_from = len(messages)
+        while keep_from > 0 and len(messages) - keep_from < self.max_recent_messages:
+            cost = estimate_tokens(messages[keep_from - 1]['content'])
+            if cost > budget:
+                break
+            budget -= cost
+            keep_from -= 1
+        # Never start the history on an assistant reply
+        while keep_from < len(messages) and messages[keep_from]['role'] != 'user':
+            keep_from += 1
+
+        dropped = [(first_index + i, message) for i, message in enumerate(messages[:keep_from])]
+        new_lines = [summarize_turn(message) for index, message in dropped if index >= summarized_count]
+        if new_lines:
+            summary = self._trim_summary('\n'.join(filter(None, [summary] + new_lines)))
+            summarized_count = first_index + keep_from
+
+        history = [{'role': m['role'], 'content': m['content']} for m in messages[keep_from:]]
+        return history, summary, summarized_count
+
+    def _trim_summary(self, summary):
+        # Keep the newest lines that fit the summary budget
+        lines = summary.split('\n')
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.summary_budget:
+            lines.pop(0)
+        return '\n'.join(lines)
+
+    def append(self, conversation_id, user_id, user_message, assistant_message, model,
+               summary=None, summarized_count=None):
+        now = datetime.utcnow()
+        update = {
+            '$push': {'messages': {
+                '$each': [
+                    {'role': 'user', 'content': user_message, 'at': now},
+                    {'role': 'assistant', 'content': assistant_message, 'model': model, 'at': now}
+                ],
+                '$slice': -self.max_stored_messages
+            }},
+            '$inc': {'message_count': 2},
+            '$set': {'updated_at': now}
+        }
+        if summary is not None:
+            update['$set']['summary'] = summary
+            update['$set']['summarized_count'] = summarized_count
+        self.collection.update_one({'_id': ObjectId(conversation_id), 'user_id': user_id}, update)
@@ -0,0 +1,118 @@
+"""Result cache for /execute.
+
+Re-running the same snippet on the same runtime gives the same output as
+long as the snippet doesn't depend on the clock, randomness, the network,
+the filesystem or input. Requests opt in with ``"cache": true``. Snippets
+that look nondeterministic are never cached, and neither are runs that
+failed, timed out or printed more than ``max_output_bytes``, or whose
+output shows a memory address (default object reprs), which changes from
+one process to the next. Keys cover the language, the code, stdin and the
+runtime version.
+"""
+import ast
+import hashlib
+import re
+
+from ttl_cache import TTLCache
+
+# Anything that can make two runs of the same code print different things.
+# Python snippets are parsed, so every module of ``import a, b.c`` and
+# ``from x import (...)`` is checked, not just the first.
+_PYTHON_NONDETERMINISTIC_MODULES = frozenset((
+    'time', 'datetime', 'random', 'secrets', 'uuid', 'os', 'sys', 'socket', 'ssl', 'http', 'urllib', 'requests',
+    'subprocess', 'threading', 'multiprocessing', 'asyncio', 'signal', 'tempfile', 'shutil', 'glob', 'pathlib',
+    'importlib', 'builtins', 'io'
+))
+_PYTHON_NONDETERMINISTIC_CALLS = frozenset((
+    'input', 'open', 'id', 'hash', '__import__', 'exec', 'eval', 'import_module'
+))
+_NONDETERMINISTIC = {
+    'javascript': re.compile(
+        r'\bDate\b|Math\.random|\bperformance\b|process\.(hrtime|env|argv|pid|stdin|memoryUsage|cpuUsage)'
+        r'|\b(fetch|require|import|setTimeout|setInterval|setImmediate|eval|Function)\s*\(|\bimport\s'
+        r'|\bcrypto\b|\bWeakRef\b'
+    ),
+    'java': re.compile(
+        r'\b(System\.(currentTimeMillis|nanoTime|getenv|getProperty|identityHashCode|in)|Math\.random|Random|'
+        r'SecureRandom|ThreadLocalRandom|UUID|Instant|LocalDate|LocalDateTime|LocalTime|ZonedDateTime|Clock|'
+        r'Date|Calendar|Thread|Executor|Executors|CompletableFuture|Socket|URL|URI|HttpClient|File|Files|'
+        r'Paths|Scanner|Runtime|ProcessBuilder|hashCode)\b'
+    )
+}
+
+# Default reprs like <Foo object at 0x7f3a...>
+_MEMORY_ADDRESS = re.compile(r'\bat 0x[0-9a-fA-F]+')
+
+
+def _python_is_deterministic(code):
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            # Relative imports have no module of their own to check
+            modules = [node.module] if node.module else []
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+            if name in _PYTHON_NONDETERMINISTIC_CALLS:
+                return False
+            continue
+        else:
+            continue
+        if any(module.split('.')[0] in _PYTHON_NONDETERMINISTIC_MODULES for module in modules):
+            return False
+    return True
+
+
+def is_deterministic(language, code):
+    if language == 'python':
+        return _python_is_deterministic(code)
+    pattern = _NONDETERMINISTIC.get(language)
+    return pattern is not None and not pattern.search(code)
+
+
+class ExecutionCache:
+    def __init__(self, max_entries=500, ttl=24 * 3600, max_bytes=16 * 1024 * 1024, max_output_bytes=64 * 1024):
+        self.max_output_bytes = max_output_bytes
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes,
+                               sizeof=lambda result: len(result['output']) + len(result['error']))
+        self.skipped = 0
+
+    @staticmethod
+    def key(language, code, stdin, runtime_version):
+        digest = hashlib.sha256()
+        for part in (language, runtime_version, stdin, code):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def lookup_key(self, language, code, stdin, runtime_version):
+        """Cache key for a run, or None if it must not be cached"""
+        if runtime_version is None or not is_deterministic(language, code):
+            self.skipped += 1
+            return None
+        return self.key(language, code, stdin, runtime_version)
+
+    def get(self, key):
+        return self.memory.get(key)
+
+    def set(self, key, result):
+        """Cache a run's result if it finished cleanly"""
+        if not result.get('success'):
+            return
+        if _MEMORY_ADDRESS.search(result['output']) or _MEMORY_ADDRESS.search(result['error']):
+            return
+        size = len(result['output'].encode('utf-8')) + len(result['error'].encode('utf-8'))
+        if size > self.max_output_bytes:
+            return
+        self.memory.set(key, {'output': result['output'], 'error': result['error'],
+                              'success': True, 'usage': result.get('usage')})
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['skipped'] = self.skipped
+        return stats
@@ -0,0 +1,170 @@
+"""Catalog of the files in generated_code/, kept in the host-local store.
+
+The app writes generated files to per-user workspaces now, so this
+directory only changes through the terminal and other tools. A reconcile
+pass picks those changes up: it runs only when the directory's mtime has
+moved or ``reconcile_interval`` has passed, and costs one scandir.
+Listings are keyset-paginated queries over indexed columns, so a page
+costs the same however large the directory grows.
+"""
+import base64
+import json
+import os
+import time
+from datetime import datetime
+
+EXTENSION_LANGUAGES = {
+    '.py': 'python',
+    '.js': 'javascript',
+    '.ts': 'typescript',
+    '.java': 'java',
+    '.cpp': 'cpp',
+    '.c': 'c',
+    '.html': 'html',
+    '.css': 'css',
+    '.sql': 'sql',
+    '.php': 'php',
+    '.rb': 'ruby',
+    '.go': 'go',
+    '.rs': 'rust',
+    '.json': 'json',
+    '.md': 'markdown',
+    '.txt': 'text'
+}
+
+SORT_COLUMNS = ('name', 'mtime', 'size', 'language')
+
+
+def detect_language(name):
+    return EXTENSION_LANGUAGES.get(os.path.splitext(name)[1].lower(), 'other')
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def list_page(store, table, filters, limit, sort, descending, language, prefix, cursor):
+    """Keyset-paginated page of a table with name, size, mtime_ns, language and owner columns.
+
+    ``filters`` is a list of extra ``(condition, params)`` to AND in.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'Cannot sort by {sort}')
+    column = 'mtime_ns' if sort == 'mtime' else sort
+    conditions, params = [], []
+    for condition, values in filters:
+        conditions.append(condition)
+        params += values
+    if language:
+        conditions.append('language = ?')
+        params.append(language)
+    if prefix:
+        # A range instead of LIKE, so the name index is used
+        conditions.append('name >= ? AND name < ?')
+        params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    if cursor:
+        conditions.append(f'({column}, name) {"<" if descending else ">"} (?, ?)')
+        params += _decode_cursor(cursor)
+
+    direction = 'DESC' if descending else 'ASC'
+    sql = f'SELECT name, size, mtime_ns, language, owner FROM {table}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {column} {direction}, name {direction} LIMIT ?'
+    rows = store.execute(sql, params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = dict(zip(('name', 'size', 'mtime_ns', 'language', 'owner'), rows[-1]))
+        next_cursor = _encode_cursor([last[column], last['name']])
+    items = [{
+        'name': name,
+        'size': size,
+        'modified_at': datetime.utcfromtimestamp(mtime_ns / 1e9).isoformat() + 'Z',
+        'language': language,
+        'owner': owner
+    } for name, size, mtime_ns, language, owner in rows]
+    return items, next_cursor
+
+
+class FileCatalog:
+    def __init__(self, store, directory, reconcile_interval=30):
+        self.store = store
+        self.directory = directory
+        self.reconcile_interval = reconcile_interval
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('file_catalog', [
+            '''CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                language TEXT NOT NULL,
+                owner TEXT
+            )''',
+            'CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime_ns, name)',
+            'CREATE INDEX IF NOT EXISTS files_size ON files (size, name)',
+            'CREATE INDEX IF NOT EXISTS files_language ON files (language, name)',
+            '''CREATE TABLE IF NOT EXISTS file_catalog_state (
+                directory TEXT PRIMARY KEY,
+                dir_mtime_ns INTEGER NOT NULL,
+                reconciled_at REAL NOT NULL
+            )'''
+        ])
+
+    def reconcile(self, force=False):
+        """Bring the catalog in line with the directory if it may have changed"""
+        self._ensure_schema()
+        os.makedirs(self.directory, exist_ok=True)
+        dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        state = self.store.execute('SELECT dir_mtime_ns, reconciled_at FROM file_catalog_state WHERE directory = ?',
+                                   (self.directory,)).fetchone()
+        if (not force and state is not None and state[0] == dir_mtime_ns
+                and time.time() - state[1] < self.reconcile_interval):
+            return
+
+        on_disk = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Skip files still being written under a temp name
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    stat = entry.stat()
+                    on_disk[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        known = {name: (size, mtime_ns) for name, size, mtime_ns in
+                 self.store.execute('SELECT name, size, mtime_ns FROM files')}
+
+        changed = [(name, size, mtime_ns, detect_language(name)) for name, (size, mtime_ns) in on_disk.items()
+                   if known.get(name) != (size, mtime_ns)]
+        removed = [(name,) for name in known if name not in on_disk]
+
+        conn = self.store.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                '''INSERT INTO files (name, size, mtime_ns, language) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns''',
+                changed
+            )
+            conn.executemany('DELETE FROM files WHERE name = ?', removed)
+            conn.execute('INSERT OR REPLACE INTO file_catalog_state (directory, dir_mtime_ns, reconciled_at) '
+                         'VALUES (?, ?, ?)', (self.directory, dir_mtime_ns, time.time()))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def list(self, limit=100, sort='name', descending=False, language=None, prefix=None, cursor=None):
+        """One page of files as ``(items, next_cursor)``; ``next_cursor`` is None on the last page"""
+        self._ensure_schema()
+        return list_page(self.store, 'files', [], limit, sort, descending, language, prefix, cursor)
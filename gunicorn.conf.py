@@ -0,0 +1,47 @@
+"""Gunicorn settings: ``gunicorn -c gunicorn.conf.py app:app``.
+
+Most requests spend their time waiting: on the upstream LLM (up to a
+minute for a chat answer or stream), on MongoDB, or on a queued job. The
+default ``gthread`` profile gives every worker process a pool of threads,
+so one process holds hundreds of waiting requests instead of one, and
+concurrency grows by threads rather than by whole processes. CPU-heavy
+work already runs elsewhere: bcrypt on its own bounded pool, code in the
+sandbox pools.
+
+``GUNICORN_WORKER_CLASS=gevent`` is an opt-in profile for deployments that
+are almost all chat traffic (needs ``pip install gevent``). Greenlets make
+waiting nearly free, but anything that blocks in C without yielding (bcrypt,
+SQLite, waiting on sandbox processes) stalls every request in that worker
+while it runs, so prefer gthread unless chat concurrency dominates.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+
+if worker_class == 'gevent':
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+    concurrency = worker_connections
+else:
+    threads = int(os.getenv('GUNICORN_THREADS', 100))
+    concurrency = threads
+
+# Each worker's upstream connection pool and hedging threads should be able to
+# serve every request it can hold at once
+os.environ.setdefault('GROQ_POOL_SIZE', str(min(concurrency, 200)))
+
+# Threaded and async workers heartbeat independently of requests, so this only
+# catches a stuck worker; long chat streams are not cut off by it
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    # Signup relies on the unique user indexes; a worker that can't create them
+    # (MongoDB unreachable, duplicate accounts) fails to boot instead of serving
+    from app import user_store
+    user_store.ensure_indexes()
@@ -0,0 +1,66 @@
+"""Rewrites relative asset references in generated HTML for /preview.
+
+The preview page is served from /preview/<file> but its stylesheets,
+scripts and images live under /generated_code/, so relative ``href`` and
+``src`` values are pointed there. One precompiled pattern finds every
+candidate attribute in a single pass. Rewritten files are cached by path,
+mtime and size, so the constantly-reloading preview iframe only pays for
+the rewrite once per edit.
+"""
+import os
+import re
+
+from ttl_cache import TTLCache
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'svg', 'ico', 'webp')
+
+# Which attribute may point at which kind of asset
+_REWRITTEN = {
+    'href': {'css'} | set(IMAGE_EXTENSIONS),
+    'src': {'js'} | set(IMAGE_EXTENSIONS)
+}
+
+_ASSET_REFERENCE = re.compile(
+    r'(href|src)=["\']([^"\']*\.(css|js|' + '|'.join(IMAGE_EXTENSIONS) + r'))["\']',
+    re.IGNORECASE
+)
+_EXTERNAL = re.compile(r'http|//', re.IGNORECASE)
+
+
+def rewrite_asset_urls(html, prefix='/generated_code/'):
+    """Point relative stylesheet, script and image references at ``prefix``"""
+    def replace(match):
+        attribute, value, extension = match.group(1).lower(), match.group(2), match.group(3).lower()
+        if extension not in _REWRITTEN[attribute]:
+            return match.group(0)
+        # A bare stylesheet or script name is local even if it starts with "http" (e.g. http-client.js)
+        if _EXTERNAL.match(value) and (extension in IMAGE_EXTENSIONS or '/' in value):
+            return match.group(0)
+        return f'{attribute}="{prefix}{value}"'
+
+    return _ASSET_REFERENCE.sub(replace, html)
+
+
+class PreviewCache:
+    """Preview-ready file contents, keyed by path, mtime and size"""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.memory = TTLCache(max_entries=max_entries, ttl=0, max_bytes=max_bytes)
+
+    def load(self, path, name=None):
+        """Text of ``path`` (rewritten if ``name`` is HTML); raises FileNotFoundError if it is missing"""
+        stat = os.stat(path)
+        # One blob can be saved under an HTML name and a non-HTML one
+        is_html = (name or path).endswith('.html')
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, is_html)
+        content = self.memory.get(key)
+        if content is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            if is_html:
+                content = rewrite_asset_urls(content)
+            self.memory.set(key, content)
+        return content
+
+    def stats(self):
+        return self.memory.stats()
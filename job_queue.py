@@ -0,0 +1,323 @@
+"""Background job queue for /execute and /terminal.
+
+Submitting returns a job ID right away; a bounded pool of threads runs the
+jobs so request workers are never held for the length of user code. Each
+user has their own queue and the pool serves users round-robin, so one
+user submitting many slow jobs can't starve everybody else.
+
+The limits hold for the whole host, not per gunicorn worker: every queued
+or running job holds a row in the shared ``job_slots`` table, and taking
+one is a single transaction that counts and inserts (or claims) together.
+A user never has more than ``max_queued_per_user`` jobs waiting or
+``max_running_per_user`` running, whichever worker they landed on. Slots
+held by a worker process that has died are reclaimed when a limit is hit.
+
+Job state lives in the host-local store, so a client can poll (or
+subscribe to) a job from whichever gunicorn worker answers the request.
+Output a job writes while it runs is stored there too, in batches and
+capped at ``output_limit`` bytes per job, so clients can show it live.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by ``submit`` when the user's or the global queue limit is reached"""
+
+
+def truncation_marker(limit):
+    return f'\n[output truncated after {limit // 1024} KB]\n'
+
+
+def truncate_output(text, limit):
+    """``text`` cut to ``limit`` UTF-8 bytes, with a marker if anything was dropped"""
+    data = text.encode('utf-8')
+    if len(data) <= limit:
+        return text
+    return data[:limit].decode('utf-8', errors='ignore') + truncation_marker(limit)
+
+
+class JobOutput:
+    """Live output of one job, capped at ``limit`` bytes and written to the store in batches"""
+
+    def __init__(self, store, job_id, limit, flush_interval=0.1):
+        self.store = store
+        self.job_id = job_id
+        self.limit = limit
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.truncated = False
+        self._seq = 0
+        self._pending = []  # [stream, text]
+        self._last_flush = time.monotonic()
+
+    def write(self, text, stream='stdout'):
+        if self.truncated or not text:
+            return
+        size = len(text.encode('utf-8'))
+        if self.written + size > self.limit:
+            kept = text.encode('utf-8')[:self.limit - self.written]
+            text = kept.decode('utf-8', errors='ignore') + truncation_marker(self.limit)
+            self.truncated = True
+            size = self.limit - self.written
+        self.written += size
+
+        if self._pending and self._pending[-1][0] == stream:
+            self._pending[-1][1] += text
+        else:
+            self._pending.append([stream, text])
+        if self.truncated or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        rows = []
+        for stream, text in self._pending:
+            self._seq += 1
+            rows.append((self.job_id, self._seq, stream, text))
+        self._pending = []
+        self.store.executemany('INSERT INTO job_output (job_id, seq, stream, data) VALUES (?, ?, ?, ?)', rows)
+
+
+class JobQueue:
+    def __init__(self, store, workers=4, max_queued_per_user=5, max_queued=100, result_ttl=600,
+                 output_limit=256 * 1024, max_running_per_user=2, poll_interval=0.25):
+        self.store = store
+        self.workers = workers
+        self.max_queued_per_user = max_queued_per_user
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.output_limit = output_limit
+        self.max_running_per_user = max_running_per_user
+        # How often a worker with jobs held back by the running quota rechecks it,
+        # since the slot may be freed by another process
+        self.poll_interval = poll_interval
+        self._queues = OrderedDict()  # user -> deque of (job_id, owner, fn)
+        self._cond = threading.Condition()
+        self._threads = []
+        self._submitted = 0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('jobs', [
+            '''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )''',
+            'CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at)',
+            '''CREATE TABLE IF NOT EXISTS job_output (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                stream TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )''',
+            '''CREATE TABLE IF NOT EXISTS job_slots (
+                job_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                state TEXT NOT NULL,
+                pid INTEGER NOT NULL
+            )''',
+            'CREATE INDEX IF NOT EXISTS job_slots_owner ON job_slots (owner, state)'
+        ])
+
+    def _transaction(self, fn):
+        conn = self.store.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    @staticmethod
+    def _reap(conn):
+        """Free the slots of worker processes that are gone; returns whether any were"""
+        dead = []
+        for (pid,) in conn.execute('SELECT DISTINCT pid FROM job_slots').fetchall():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                dead.append((pid,))
+            except PermissionError:
+                pass
+        conn.executemany('DELETE FROM job_slots WHERE pid = ?', dead)
+        return bool(dead)
+
+    @staticmethod
+    def _count(conn, owner, state):
+        """``(all, owner's)`` slots in ``state`` across every worker"""
+        total, mine = conn.execute('SELECT COUNT(*), COALESCE(SUM(owner = ?), 0) FROM job_slots WHERE state = ?',
+                                   (owner, state)).fetchone()
+        return total, mine
+
+    def start(self):
+        # Threads are started lazily so a forked gunicorn worker gets its own
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, owner, kind, fn):
+        """Queue ``fn(output)`` and return the job ID.
+
+        ``fn`` returns the JSON-able result and may ``output.write(text, stream)``
+        as it goes.
+        """
+        self._ensure_schema()
+        self.start()
+        job_id = uuid.uuid4().hex
+
+        def enqueue(conn):
+            queued, mine = self._count(conn, owner, QUEUED)
+            if (queued >= self.max_queued or mine >= self.max_queued_per_user) and self._reap(conn):
+                queued, mine = self._count(conn, owner, QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFull('The server is busy, please try again in a moment')
+            if mine >= self.max_queued_per_user:
+                raise QueueFull(f'You already have {self.max_queued_per_user} jobs waiting')
+            now = time.time()
+            conn.execute('INSERT INTO jobs (id, owner, kind, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, owner, kind, QUEUED, now, now))
+            conn.execute('INSERT INTO job_slots (job_id, owner, state, pid) VALUES (?, ?, ?, ?)',
+                         (job_id, owner, QUEUED, os.getpid()))
+
+        self._transaction(enqueue)
+        with self._cond:
+            self._queues.setdefault(owner, deque()).append((job_id, owner, fn))
+            self._submitted += 1
+            self._cond.notify()
+
+        if self._submitted % 100 == 0:
+            self._purge()
+        return job_id
+
+    def _purge(self):
+        cutoff = time.time() - self.result_ttl
+        self.store.execute('DELETE FROM job_output WHERE job_id IN '
+                           '(SELECT id FROM jobs WHERE updated_at < ? AND status IN (?, ?))', (cutoff, DONE, FAILED))
+        self.store.execute('DELETE FROM jobs WHERE updated_at < ? AND status IN (?, ?)', (cutoff, DONE, FAILED))
+
+    def _claim(self, owner, job_id):
+        """Move a job's slot from queued to running if its owner is below the running quota"""
+        def claim(conn):
+            _, running = self._count(conn, owner, RUNNING)
+            if running >= self.max_running_per_user and self._reap(conn):
+                _, running = self._count(conn, owner, RUNNING)
+            if running >= self.max_running_per_user:
+                return False
+            conn.execute('UPDATE job_slots SET state = ? WHERE job_id = ?', (RUNNING, job_id))
+            return True
+        try:
+            return self._transaction(claim)
+        except Exception as e:
+            # e.g. the store is locked for longer than its timeout; try again on the next pass
+            print(f"Failed to claim a slot for job {job_id}: {e}")
+            return False
+
+    def _next(self):
+        # Round-robin over users: take one job from the first user below their
+        # running quota, then move them to the back
+        with self._cond:
+            while True:
+                owner = next((owner for owner, user_queue in self._queues.items()
+                              if self._claim(owner, user_queue[0][0])), None)
+                if owner is not None:
+                    break
+                # Another worker process may free a slot without notifying us
+                self._cond.wait(self.poll_interval if self._queues else None)
+            user_queue = self._queues.pop(owner)
+            job = user_queue.popleft()
+            if user_queue:
+                self._queues[owner] = user_queue
+            return job
+
+    def _finished(self, job_id):
+        try:
+            self.store.execute('DELETE FROM job_slots WHERE job_id = ?', (job_id,))
+        except Exception as e:
+            print(f"Failed to free the slot of job {job_id}: {e}")
+        with self._cond:
+            # The user's next job may be runnable now
+            self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            job_id, owner, fn = self._next()
+            self._update(job_id, RUNNING)
+            output = JobOutput(self.store, job_id, self.output_limit)
+            try:
+                result = fn(output)
+                status = DONE
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                result = {'error': f'Job failed: {str(e)}', 'success': False}
+                status = FAILED
+            try:
+                # Output lands before the result, so a client that sees the result has all of it
+                output.flush()
+            except Exception as e:
+                print(f"Failed to store output of job {job_id}: {e}")
+            self._update(job_id, status, result)
+            self._finished(job_id)
+
+    def _update(self, job_id, status, result=None):
+        try:
+            self.store.execute('UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?',
+                               (status, json.dumps(result) if result is not None else None, time.time(), job_id))
+        except Exception as e:
+            print(f"Failed to update job {job_id}: {e}")
+
+    def get(self, job_id, owner):
+        """Job status dict, or None if it doesn't exist or belongs to someone else"""
+        self._ensure_schema()
+        row = self.store.execute('SELECT kind, status, result, created_at FROM jobs WHERE id = ? AND owner = ?',
+                                 (job_id, owner)).fetchone()
+        if row is None:
+            return None
+        kind, status, result, created_at = row
+        job = {'job_id': job_id, 'kind': kind, 'status': status, 'created_at': created_at}
+        if result is not None:
+            job['result'] = json.loads(result)
+        return job
+
+    def output(self, job_id, since=0):
+        """Output chunks after sequence number ``since``, as ``[{'seq', 'stream', 'data'}]``"""
+        rows = self.store.execute('SELECT seq, stream, data FROM job_output WHERE job_id = ? AND seq > ? ORDER BY seq',
+                                  (job_id, since)).fetchall()
+        return [{'seq': seq, 'stream': stream, 'data': data} for seq, stream, data in rows]
+
+    def stats(self):
+        """Queued and running jobs across the host; ``users_waiting`` is for this worker"""
+        self._ensure_schema()
+        counts = dict(self.store.execute('SELECT state, COUNT(*) FROM job_slots GROUP BY state').fetchall())
+        with self._cond:
+            users_waiting = len(self._queues)
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'running': counts.get(RUNNING, 0),
+            'users_waiting': users_waiting,
+            'workers': self.workers
+        }
@@ -0,0 +1,207 @@
+"""Pooled HTTP client for the upstream LLM (Groq) chat completions API.
+
+One ``requests.Session`` is kept per worker process so connections to the
+provider stay alive between requests instead of paying a new TCP + TLS
+handshake on every call.
+
+``hedged_chat`` races the configured models: if the current attempt hasn't
+answered within the hedge delay (or fails), the next model is started
+alongside it and the first good answer wins. With a rate limiter attached,
+every response's rate limit headers are reported to it and models it
+knows to be out of quota are skipped.
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from per_process import PerProcess
+from rate_limiter import parse_duration
+
+ChatResult = namedtuple('ChatResult', ['model', 'content', 'data'])
+
+
+class UpstreamError(Exception):
+    """Raised when a model (or every model in a hedged call) fails to answer"""
+
+    def __init__(self, message, model=None, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.model = model
+        self.status_code = status_code
+        # Seconds the provider asked us to wait, on 429s
+        self.retry_after = retry_after
+
+
+class UpstreamClient:
+    def __init__(self, api_url, api_key, pool_size=10, connect_timeout=3.05, read_timeout=15, health=None,
+                 rate_limiter=None):
+        self.api_url = api_url
+        # Optional ModelHealth that every attempt's outcome is reported to
+        self.health = health
+        # Optional ChatRateLimiter that learns each model's quota from the responses
+        self.rate_limiter = rate_limiter
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        # Built once instead of on every request
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self._session = PerProcess(self._build_session)
+        self._executor = PerProcess(
+            lambda: ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='llm-hedge'))
+
+    @property
+    def session(self):
+        return self._session.get()
+
+    @property
+    def executor(self):
+        return self._executor.get()
+
+    def _build_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def chat(self, payload, timeout=None):
+        """POST a chat completion and return the ``requests.Response``"""
+        return self.session.post(self.api_url, json=payload, timeout=timeout or self.timeout)
+
+    def stream_chat(self, payload, timeout=None):
+        """POST a streaming chat completion; use the response as a context manager"""
+        return self.session.post(self.api_url, json=payload, timeout=timeout or self.timeout, stream=True)
+
+    def complete(self, payload, model, cancelled=None):
+        """Run one non-streaming completion against ``model`` and return a ``ChatResult``"""
+        started = time.monotonic()
+        try:
+            response = self.chat(dict(payload, model=model))
+        except requests.RequestException:
+            self.record(model, False, latency=time.monotonic() - started)
+            raise
+        try:
+            self.observe(model, response)
+            if cancelled is not None and cancelled.is_set():
+                # Another model already won; don't bother reading the body
+                raise UpstreamError('Cancelled', model=model)
+            if response.status_code != 200:
+                self.record(model, False, response.status_code, time.monotonic() - started)
+                raise UpstreamError(f"{model} failed with {response.status_code}: {response.text[:200]}",
+                                    model=model, status_code=response.status_code,
+                                    retry_after=parse_duration(response.headers.get('retry-after')))
+            data = response.json()
+            content = data['choices'][0]['message']['content'].strip()
+            self.record(model, True, response.status_code, time.monotonic() - started)
+            return ChatResult(model, content, data)
+        finally:
+            response.close()
+
+    def observe(self, model, response):
+        """Report a response's rate limit headers (and 429s) to the rate limiter"""
+        if self.rate_limiter is None:
+            return
+        try:
+            self.rate_limiter.observe(model, response.status_code, response.headers)
+        except Exception as e:
+            print(f"Failed to record rate limits for {model}: {e}")
+
+    def available(self, model):
+        """False while the provider has told us ``model`` is out of quota"""
+        if self.rate_limiter is None:
+            return True
+        try:
+            return self.rate_limiter.available(model)
+        except Exception:
+            return True
+
+    def record(self, model, ok, status=None, latency=None):
+        if self.health is None:
+            return
+        try:
+            self.health.record(model, ok, status, latency)
+        except Exception as e:
+            # Health bookkeeping must never fail the chat request itself
+            print(f"Failed to record health for {model}: {e}")
+
+    def hedged_chat(self, payload, models, hedge_delays=(2.5,)):
+        """Return the first successful ``ChatResult`` from ``models``.
+
+        ``models[0]`` starts immediately. Whenever the running attempts have
+        not produced an answer within the next hedge delay, or one of them
+        fails, the next model is started concurrently. Once a model answers,
+        attempts that haven't started are cancelled and the results of those
+        still in flight are discarded. Raises ``UpstreamError`` when every
+        model fails.
+        """
+        if not models:
+            raise UpstreamError('No models configured')
+
+        cancelled = threading.Event()
+        pending = {}
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            while next_index < len(models):
+                model = models[next_index]
+                next_index += 1
+                # Skip models that ran out of quota since the call started (e.g. a 429 from a concurrent request)
+                if not self.available(model):
+                    print(f"Skipping rate-limited model: {model}")
+                    continue
+                print(f"Starting model attempt: {model}")
+                future = self.executor.submit(self.complete, payload, model, cancelled)
+                pending[future] = (model, time.monotonic())
+                return
+
+        launch()
+        try:
+            while pending:
+                if next_index < len(models):
+                    delay = hedge_delays[min(next_index - 1, len(hedge_delays) - 1)]
+                else:
+                    # Nothing left to hedge with; wait for the attempts in flight
+                    delay = None
+                done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    model, started = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Model {model} failed: {e}")
+                        errors.append(e)
+                        continue
+                    print(f"Model {model} answered in {time.monotonic() - started:.2f}s")
+                    return result
+
+                # Hedge when the delay expired or an attempt failed
+                if next_index < len(models):
+                    launch()
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+
+        rate_limited = [e for e in errors if getattr(e, 'status_code', None) == 429]
+        if len(rate_limited) == len(errors):
+            # Every model is out of quota: say so, rather than as a generic failure
+            retry_after = min((e.retry_after for e in rate_limited if e.retry_after is not None), default=None)
+            raise UpstreamError(f"All {len(models)} models are rate limited", status_code=429, retry_after=retry_after)
+        raise UpstreamError(f"All {len(models)} models failed: {'; '.join(str(e) for e in errors)}")
+
+    def close(self):
+        session = self._session.clear()
+        if session is not None:
+            session.close()
+        executor = self._executor.clear()
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,49 @@
+"""Small SQLite store shared by all gunicorn workers on the same host.
+
+Used for state that every worker should see (model health, caches, ...)
+but that is too hot or too short-lived to put in MongoDB.
+"""
+import os
+import sqlite3
+import threading
+
+
+class LocalStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schemas = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def connection(self):
+        # sqlite3 connections can't cross threads or forks, so keep one per
+        # thread and rebuild it in a freshly forked worker
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def ensure_schema(self, name, statements):
+        """Run ``statements`` (CREATE ... IF NOT EXISTS) once per process"""
+        if name in self._schemas:
+            return
+        with self._schema_lock:
+            if name in self._schemas:
+                return
+            conn = self.connection()
+            for statement in statements:
+                conn.execute(statement)
+            self._schemas.add(name)
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.connection().executemany(sql, rows)
@@ -0,0 +1,158 @@
+"""Per-model health tracking and circuit breaking for the chat fallback chain.
+
+Every upstream attempt is recorded in the shared local store, so all
+workers see the same rolling window of outcomes. A model whose error rate
+crosses the threshold (or that the provider reports as gone) has its
+circuit opened and is skipped until the open period ends. After that one
+request is let through as a half-open probe: success closes the circuit,
+failure re-opens it for twice as long.
+"""
+import time
+from itertools import groupby
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Statuses that mean the model itself is unavailable (retired, unknown)
+DEAD_MODEL_STATUSES = (404, 410)
+
+
+class ModelHealth:
+    def __init__(self, store, window=300, min_samples=4, error_threshold=0.5,
+                 open_seconds=30, max_open_seconds=900, probe_timeout=30):
+        self.store = store
+        self.window = window
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_timeout = probe_timeout
+        self._records = 0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('model_health', [
+            '''CREATE TABLE IF NOT EXISTS model_events (
+                model TEXT NOT NULL,
+                ts REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                status INTEGER,
+                latency REAL
+            )''',
+            'CREATE INDEX IF NOT EXISTS model_events_model_ts ON model_events (model, ts)',
+            '''CREATE TABLE IF NOT EXISTS model_circuits (
+                model TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                open_until REAL NOT NULL DEFAULT 0,
+                probe_at REAL NOT NULL DEFAULT 0,
+                trips INTEGER NOT NULL DEFAULT 0
+            )'''
+        ])
+
+    def record(self, model, ok, status=None, latency=None):
+        """Record one attempt and open or close the model's circuit accordingly"""
+        self._ensure_schema()
+        now = time.time()
+        self.store.execute('INSERT INTO model_events (model, ts, ok, status, latency) VALUES (?, ?, ?, ?, ?)',
+                           (model, now, 1 if ok else 0, status, latency))
+
+        self._records += 1
+        if self._records % 100 == 0:
+            self.store.execute('DELETE FROM model_events WHERE ts < ?', (now - self.window,))
+
+        state, _, trips = self._circuit(model)
+        if ok:
+            if state != CLOSED:
+                print(f"Circuit for {model} closed")
+                self.store.execute('DELETE FROM model_circuits WHERE model = ?', (model,))
+            return
+
+        if status in DEAD_MODEL_STATUSES:
+            self._open(model, self.max_open_seconds, trips)
+        elif state == HALF_OPEN:
+            self._open(model, self.open_seconds * (2 ** (trips + 1)), trips + 1)
+        elif state == CLOSED:
+            stats = self.stats(model)
+            if stats['samples'] >= self.min_samples and stats['error_rate'] >= self.error_threshold:
+                self._open(model, self.open_seconds, 0)
+
+    def _open(self, model, seconds, trips):
+        seconds = min(seconds, self.max_open_seconds)
+        print(f"Circuit for {model} opened for {seconds:.0f}s")
+        self.store.execute(
+            '''INSERT INTO model_circuits (model, state, open_until, trips) VALUES (?, ?, ?, ?)
+               ON CONFLICT(model) DO UPDATE SET state = excluded.state, open_until = excluded.open_until,
+                                                trips = excluded.trips''',
+            (model, OPEN, time.time() + seconds, trips))
+
+    def _circuit(self, model):
+        row = self.store.execute('SELECT state, open_until, trips FROM model_circuits WHERE model = ?',
+                                 (model,)).fetchone()
+        return row if row else (CLOSED, 0, 0)
+
+    def allow(self, model):
+        """Whether a request may be sent to ``model`` right now.
+
+        When an open circuit has expired, the first caller atomically claims
+        the half-open probe and every other caller is refused until the probe
+        reports back (or is presumed lost after ``probe_timeout``).
+        """
+        self._ensure_schema()
+        state, open_until, _ = self._circuit(model)
+        if state == CLOSED:
+            return True
+        now = time.time()
+        claimed = self.store.execute(
+            '''UPDATE model_circuits SET state = ?, probe_at = ?
+               WHERE model = ? AND ((state = ? AND open_until <= ?) OR (state = ? AND probe_at <= ?))''',
+            (HALF_OPEN, now, model, OPEN, now, HALF_OPEN, now - self.probe_timeout))
+        return claimed.rowcount == 1
+
+    def stats(self, model):
+        self._ensure_schema()
+        row = self.store.execute(
+            '''SELECT COUNT(*), SUM(1 - ok), SUM(CASE WHEN status = 429 THEN 1 ELSE 0 END), AVG(CASE WHEN ok THEN latency END)
+               FROM model_events WHERE model = ? AND ts >= ?''',
+            (model, time.time() - self.window)).fetchone()
+        samples, errors, rate_limited, avg_latency = row
+        state, open_until, trips = self._circuit(model)
+        return {
+            'model': model,
+            'samples': samples,
+            'error_rate': (errors or 0) / samples if samples else 0.0,
+            'rate_limited': rate_limited or 0,
+            'avg_latency': avg_latency,
+            'state': state,
+            'open_until': open_until,
+            'trips': trips
+        }
+
+    def order(self, models):
+        """Models whose circuit allows traffic, healthiest first.
+
+        A model being probed after an open period goes first so the probe
+        actually runs; the rest are ranked by error rate, then 429 share,
+        keeping the configured order for ties. Within a tie, models with
+        latency samples are reordered by average latency among the places
+        they hold; a model without samples (never tried, or idle for the
+        whole window) keeps its configured place, so an untried alternate
+        can't jump ahead of a measured primary.
+        """
+        ranked = []
+        for position, model in enumerate(models):
+            stats = self.stats(model)
+            if not self.allow(model):
+                continue
+            probing = stats['state'] != CLOSED
+            rate_limited_share = stats['rate_limited'] / stats['samples'] if stats['samples'] else 0.0
+            health = (not probing, round(stats['error_rate'], 1), round(rate_limited_share, 1))
+            ranked.append((health, position, stats['avg_latency'], model))
+        ranked.sort(key=lambda entry: entry[:2])
+
+        ordered = []
+        for _, group in groupby(ranked, key=lambda entry: entry[0]):
+            group = list(group)
+            by_latency = iter(sorted((entry for entry in group if entry[2] is not None),
+                                     key=lambda entry: (round(entry[2], 1), entry[1])))
+            ordered.extend(next(by_latency)[3] if entry[2] is not None else entry[3] for entry in group)
+        return ordered
@@ -0,0 +1,141 @@
+"""bcrypt hashing on a small dedicated thread pool.
+
+A bcrypt hash or check costs a few hundred milliseconds of CPU. Run inline,
+a burst of logins ties up every request thread; here at most ``workers``
+run at once per gunicorn worker and at most ``max_pending`` may be waiting
+or running. Past that, ``HashingBusy`` is raised at once so the caller can
+answer 503 instead of queueing without bound.
+
+The cost factor is ``rounds`` when given, otherwise calibrated to about
+``target_ms`` per hash on this machine, but never below bcrypt's default
+of 12. The calibrated value is shared through the host-local store so all
+workers agree on it. Checking a password whose stored hash has a lower
+cost also returns a fresh hash at the current cost, for the caller to
+save; stronger hashes are left as they are.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+from per_process import PerProcess
+
+# bcrypt's default; a slow host must not weaken existing hashes
+MIN_ROUNDS = 12
+MAX_ROUNDS = 16
+# Cost used to time the machine; cheap enough to run at startup
+_PROBE_ROUNDS = 8
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is full or a hash didn't finish in time"""
+
+
+def hash_rounds(hashed):
+    """Cost factor of a bcrypt hash such as ``$2b$12$...``"""
+    return int(hashed.split(b'$')[2])
+
+
+def calibrate_rounds(target_ms, samples=3):
+    """Highest cost whose hash takes no more than ``target_ms`` here, within MIN_ROUNDS..MAX_ROUNDS"""
+    salt = bcrypt.gensalt(_PROBE_ROUNDS)
+    best = float('inf')
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.hashpw(b'calibration', salt)
+        best = min(best, time.perf_counter() - started)
+    # Each extra round doubles the work
+    rounds = _PROBE_ROUNDS + math.floor(math.log2(target_ms / 1000 / best))
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+
+class PasswordHasher:
+    def __init__(self, workers=2, max_pending=16, rounds=None, target_ms=250, wait_timeout=10, store=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.target_ms = target_ms
+        self.wait_timeout = wait_timeout
+        # Optional LocalStore to share the calibrated cost across workers
+        self.store = store
+        self._rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = PerProcess(
+            lambda: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt'))
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def executor(self):
+        return self._executor.get()
+
+    @property
+    def rounds(self):
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = self._calibrated_rounds()
+        return self._rounds
+
+    def _calibrated_rounds(self):
+        if self.store is None:
+            return calibrate_rounds(self.target_ms)
+        self.store.ensure_schema('password_hashing', [
+            '''CREATE TABLE IF NOT EXISTS bcrypt_calibration (
+                target_ms INTEGER PRIMARY KEY,
+                rounds INTEGER NOT NULL
+            )'''
+        ])
+        row = self.store.execute('SELECT rounds FROM bcrypt_calibration WHERE target_ms = ?',
+                                 (self.target_ms,)).fetchone()
+        if row is None:
+            # First worker to get here decides; the others read its value
+            self.store.execute('INSERT OR IGNORE INTO bcrypt_calibration (target_ms, rounds) VALUES (?, ?)',
+                               (self.target_ms, calibrate_rounds(self.target_ms)))
+            row = self.store.execute('SELECT rounds FROM bcrypt_calibration WHERE target_ms = ?',
+                                     (self.target_ms,)).fetchone()
+        # Rows calibrated before the floor was raised may be lower
+        return max(MIN_ROUNDS, row[0])
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy('Too many sign-in attempts right now, please try again in a moment')
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeout:
+            raise HashingBusy('Signing in is taking too long right now, please try again in a moment')
+
+    def hash(self, password):
+        """bcrypt hash of ``password`` (str) at the current cost"""
+        rounds = self.rounds
+        return self._run(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)))
+
+    def check(self, password, hashed):
+        """``(matches, new_hash)``; ``new_hash`` is set when a matching hash is weaker than the current cost"""
+        rounds = self.rounds
+
+        def check_and_rehash():
+            if not bcrypt.checkpw(password.encode('utf-8'), hashed):
+                return False, None
+            if hash_rounds(hashed) >= rounds:
+                return True, None
+            return True, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+        return self._run(check_and_rehash)
+
+    def stats(self):
+        return {
+            'rounds': self.rounds,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'rejected': self.rejected
+        }
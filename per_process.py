@@ -0,0 +1,36 @@
+"""Values that each gunicorn worker must build for itself.
+
+gunicorn forks its workers after the app is imported. A forked child gets
+copies of the parent's objects but none of its threads, so a thread pool or
+background thread inherited that way never runs anything, and a pooled
+socket shared between processes interleaves their traffic. ``PerProcess``
+builds such a value lazily and builds it again the first time it is used in
+a new process.
+"""
+import os
+import threading
+
+
+class PerProcess:
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The value for this process, built by ``factory`` on first use here"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def clear(self):
+        """Forget the value and return it if this process built it, for the caller to close"""
+        with self._lock:
+            value = self._value if self._pid == os.getpid() else None
+            self._value = None
+            self._pid = None
+        return value
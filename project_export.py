@@ -0,0 +1,142 @@
+"""Zip downloads of generated projects.
+
+The archive is written by ``zipfile`` into a sink that cannot seek, so it
+uses data descriptors and each compressed chunk can be sent as soon as it
+is produced: memory stays flat however large the project is. While it
+streams, the archive is also written to a temp file that becomes the
+cached export once it is complete. Cache entries are keyed on the file
+names and content hashes, so exporting an unchanged project again is a
+plain ``send_file`` of the cached zip.
+"""
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+
+from flask import Response, send_file, stream_with_context
+
+from static_files import served_path
+
+# Bump when the archive layout or compression changes, so old cached exports aren't reused
+EXPORT_FORMAT = 'zip-deflate-6'
+
+
+class _ChunkSink:
+    """Write-only file object handing ``zipfile`` output back in chunks"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_key(entries):
+    """Cache key for ``[(name, path, version)]``; ``version`` is a content hash or file validator"""
+    digest = hashlib.sha256(EXPORT_FORMAT.encode('utf-8'))
+    for name, _, version in entries:
+        digest.update(b'\0' + name.encode('utf-8') + b'\0' + version.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """Yield a zip archive of ``[(name, path, version)]`` piece by piece"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        for name, path, _ in entries:
+            stat = os.stat(path)
+            info = zipfile.ZipInfo(name, date_time=time.localtime(stat.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            # Lets zipfile decide up front whether the entry needs zip64 headers
+            info.file_size = stat.st_size
+            with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    # Closing the archive wrote the central directory
+    yield sink.drain()
+
+
+class ProjectExporter:
+    def __init__(self, root, max_bytes=256 * 1024 * 1024):
+        self.root = served_path(root)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.zip')
+
+    def send(self, entries, download_name='project.zip'):
+        """Response with the zip of ``entries``: the cached archive, or one streamed while it is cached"""
+        key = export_key(entries)
+        path = self._path(key)
+        try:
+            # Most recently used exports are the last to be pruned
+            os.utime(path)
+        except FileNotFoundError:
+            return self._stream(entries, key, download_name)
+        response = send_file(path, mimetype='application/zip', as_attachment=True, download_name=download_name,
+                             etag=key, conditional=True)
+        response.headers['X-Export-Cache'] = 'hit'
+        return response
+
+    def _stream(self, entries, key, download_name):
+        def generate():
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+            completed = False
+            try:
+                with os.fdopen(fd, 'wb') as cached:
+                    for data in stream_zip(entries):
+                        cached.write(data)
+                        yield data
+                os.replace(tmp_path, self._path(key))
+                completed = True
+                self._prune()
+            finally:
+                # The client went away or a file vanished mid-export: no partial archive is cached
+                if not completed:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+        response = Response(stream_with_context(generate()), mimetype='application/zip')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        response.headers['ETag'] = f'"{key}"'
+        response.headers['X-Export-Cache'] = 'miss'
+        return response
+
+    def _prune(self):
+        """Drop the least recently used exports until the cache fits in ``max_bytes``"""
+        exports = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.endswith('.zip'):
+                    stat = entry.stat()
+                    exports.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in exports)
+        for _, size, path in sorted(exports):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
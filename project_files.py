@@ -0,0 +1,82 @@
+"""Naming and validating generated files.
+
+Code blocks can be pulled out of a raw model response here, named the same
+way the editor names them. Saving them is up to ``workspace_store``.
+"""
+import re
+
+# Files still being written; never a valid name for a saved file
+TEMP_PREFIX = '.tmp-'
+
+# Extension added to a filename that doesn't already end with its language's
+LANGUAGE_EXTENSIONS = {
+    'python': '.py',
+    'javascript': '.js',
+    'java': '.java',
+    'cpp': '.cpp',
+    'c++': '.cpp',
+    'html': '.html',
+    'css': '.css',
+    'sql': '.sql',
+    'php': '.php',
+    'ruby': '.rb',
+    'go': '.go',
+    'rust': '.rs',
+    'typescript': '.ts'
+}
+
+# Code block language tag -> (base name, extension, editor language)
+BLOCK_FILES = {
+    'html': ('index', 'html', 'html'),
+    'css': ('style', 'css', 'css'),
+    'javascript': ('script', 'js', 'javascript'),
+    'js': ('script', 'js', 'javascript'),
+    'python': ('main', 'py', 'python'),
+    'py': ('main', 'py', 'python'),
+    'java': ('Main', 'java', 'java'),
+    'json': ('data', 'json', 'json'),
+    'xml': ('data', 'xml', 'xml'),
+    'sql': ('query', 'sql', 'sql')
+}
+
+_CODE_BLOCK = re.compile(r'```(\w*)\n([\s\S]*?)\n```')
+
+
+def with_extension(filename, language):
+    extension = LANGUAGE_EXTENSIONS.get((language or '').lower())
+    if extension and not filename.endswith(extension):
+        filename += extension
+    return filename
+
+
+def check_filename(filename):
+    """Reject anything that isn't a plain file name inside the directory"""
+    if (not filename or filename in ('.', '..') or filename.startswith(TEMP_PREFIX)
+            or '/' in filename or '\\' in filename or '\0' in filename):
+        raise ValueError(f'Invalid filename: {filename!r}')
+
+
+def extract_files(response):
+    """Files for the fenced code blocks in a model response: index.html, style.css, script.js, ..."""
+    files = []
+    taken = set()
+    for tag, code in _CODE_BLOCK.findall(response):
+        base, extension, language = BLOCK_FILES.get(tag.lower(), ('file', 'txt', 'text'))
+        filename = f'{base}.{extension}'
+        counter = 1
+        while filename in taken:
+            filename = f'{base}{counter}.{extension}'
+            counter += 1
+        taken.add(filename)
+        files.append({'filename': filename, 'content': code.strip(), 'language': language})
+    return files
+
+
+def check_filenames(files):
+    """Validate a batch of ``[{'filename', 'content'}]``; returns the file names"""
+    names = [f['filename'] for f in files]
+    for name in names:
+        check_filename(name)
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicate filenames in one batch')
+    return names
@@ -0,0 +1,350 @@
+"""Rate limits and model scheduling for upstream chat calls.
+
+Every chat request that misses the cache is admitted against token
+buckets before it reaches the provider:
+
+* per user, LLM tokens and requests per minute. A user over their share
+  is turned away at once with 429 and Retry-After;
+* for the whole app, the same two limits. Requests may wait for these
+  briefly (``max_wait`` seconds, at most ``max_waiting`` waiters per
+  worker) rather than fail.
+
+Buckets are charged an estimate up front and corrected with the usage the
+provider reports. Separately, each model's quota is tracked from the
+provider's ``x-ratelimit-*`` headers and from 429 ``Retry-After``: models
+out of quota are skipped until their reset instead of being retried by
+every request, and traffic goes to the models with the most quota left.
+Buckets and quotas live in the host-local store, so every worker shares
+them.
+"""
+import math
+import re
+import threading
+import time
+from collections import namedtuple
+
+# A bucket holds up to ``capacity`` and refills at ``capacity`` per minute
+Bucket = namedtuple('Bucket', ['key', 'capacity', 'cost'])
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_SECONDS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+
+class RateLimited(Exception):
+    """Raised when a request must not go upstream yet; ``retry_after`` is in seconds"""
+
+    def __init__(self, message, retry_after, headers=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.headers = headers or {}
+
+
+def parse_duration(value):
+    """Seconds in a provider reset value such as ``"2m59.56s"``, ``"120ms"`` or ``"7"``; None if unparseable"""
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+
+class Admission:
+    """A request let through; ``settle`` it with the tokens it actually used (only the first call counts)"""
+
+    def __init__(self, limiter, buckets, estimated_tokens, remaining):
+        self.limiter = limiter
+        self.buckets = buckets
+        self.estimated_tokens = estimated_tokens
+        self.remaining = remaining
+        self.settled = False
+
+    def settle(self, used_tokens):
+        if self.settled:
+            return
+        self.settled = True
+        if used_tokens is not None:
+            self.limiter.adjust([b for b in self.buckets if b.key.endswith(':tokens')],
+                                used_tokens - self.estimated_tokens)
+
+    def headers(self):
+        return self.limiter.headers(self.remaining)
+
+
+class ChatRateLimiter:
+    def __init__(self, store, user_tokens_per_minute=20000, user_requests_per_minute=20,
+                 global_tokens_per_minute=100000, global_requests_per_minute=120,
+                 max_wait=5.0, max_waiting=20, low_quota=0.25):
+        self.store = store
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.user_requests_per_minute = user_requests_per_minute
+        self.global_tokens_per_minute = global_tokens_per_minute
+        self.global_requests_per_minute = global_requests_per_minute
+        self.max_wait = max_wait
+        # Share of a model's quota below which other models are preferred
+        self.low_quota = low_quota
+        self._waiting = threading.BoundedSemaphore(max_waiting)
+        self.rejected = 0
+        self.waited = 0
+        self._takes = 0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('rate_limiter', [
+            '''CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )''',
+            '''CREATE TABLE IF NOT EXISTS model_quotas (
+                model TEXT PRIMARY KEY,
+                limit_requests INTEGER,
+                remaining_requests INTEGER,
+                requests_reset_at REAL,
+                limit_tokens INTEGER,
+                remaining_tokens INTEGER,
+                tokens_reset_at REAL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )'''
+        ])
+
+    def _transaction(self, fn):
+        self._ensure_schema()
+        conn = self.store.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    @staticmethod
+    def _level(conn, bucket, now):
+        row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (bucket.key,)).fetchone()
+        if row is None:
+            return bucket.capacity
+        return min(bucket.capacity, row[0] + (now - row[1]) * bucket.capacity / 60)
+
+    def _take(self, buckets):
+        """Charge every bucket or none; returns ``(wait_seconds, limiting_bucket, remaining)``"""
+        def take(conn):
+            now = time.time()
+            levels = [self._level(conn, bucket, now) for bucket in buckets]
+            wait, limiting = 0.0, None
+            for bucket, level in zip(buckets, levels):
+                # A request bigger than the whole bucket waits for a full bucket
+                cost = min(bucket.cost, bucket.capacity)
+                if level < cost:
+                    bucket_wait = (cost - level) * 60 / bucket.capacity
+                    if bucket_wait > wait:
+                        wait, limiting = bucket_wait, bucket
+            if limiting is None:
+                levels = [level - min(bucket.cost, bucket.capacity) for bucket, level in zip(buckets, levels)]
+            conn.executemany('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                             [(bucket.key, level, now) for bucket, level in zip(buckets, levels)])
+            return wait, limiting, {bucket.key: level for bucket, level in zip(buckets, levels)}
+
+        result = self._transaction(take)
+        self._takes += 1
+        if self._takes % 100 == 0:
+            # Buckets untouched this long have refilled; a missing row reads as full
+            self.store.execute('DELETE FROM rate_buckets WHERE updated_at < ?', (time.time() - 600,))
+        return result
+
+    def adjust(self, buckets, delta):
+        """Charge (or refund, if negative) ``delta`` tokens once the real usage is known"""
+        if not delta:
+            return
+
+        def apply(conn):
+            now = time.time()
+            for bucket in buckets:
+                level = self._level(conn, bucket, now) - delta
+                conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                             (bucket.key, min(bucket.capacity, level), now))
+        self._transaction(apply)
+
+    def _buckets(self, user, estimated_tokens):
+        return [
+            Bucket(f'user:{user}:requests', self.user_requests_per_minute, 1),
+            Bucket(f'user:{user}:tokens', self.user_tokens_per_minute, estimated_tokens),
+            Bucket('global:requests', self.global_requests_per_minute, 1),
+            Bucket('global:tokens', self.global_tokens_per_minute, estimated_tokens)
+        ]
+
+    def headers(self, remaining):
+        """``x-ratelimit-*`` headers describing the user's own limits"""
+        requests_left = next((v for k, v in remaining.items() if k.startswith('user:') and k.endswith(':requests')), None)
+        tokens_left = next((v for k, v in remaining.items() if k.startswith('user:') and k.endswith(':tokens')), None)
+        headers = {
+            'x-ratelimit-limit-requests': str(self.user_requests_per_minute),
+            'x-ratelimit-limit-tokens': str(self.user_tokens_per_minute)
+        }
+        if requests_left is not None:
+            headers['x-ratelimit-remaining-requests'] = str(max(0, math.floor(requests_left)))
+        if tokens_left is not None:
+            headers['x-ratelimit-remaining-tokens'] = str(max(0, math.floor(tokens_left)))
+        return headers
+
+    def admit(self, user, estimated_tokens):
+        """Charge a request to the user's and the app's buckets; returns an ``Admission``.
+
+        Raises ``RateLimited`` when the user is over their limit, or when the
+        app-wide limit wouldn't free up within ``max_wait`` seconds.
+        """
+        estimated_tokens = max(1, int(estimated_tokens))
+        buckets = self._buckets(user, estimated_tokens)
+        deadline = time.monotonic() + self.max_wait
+        waiting = False
+        try:
+            while True:
+                wait, limiting, remaining = self._take(buckets)
+                if limiting is None:
+                    return Admission(self, buckets, estimated_tokens, remaining)
+                if limiting.key.startswith('user:'):
+                    self.rejected += 1
+                    raise RateLimited('You are sending requests too quickly, please wait a moment',
+                                      wait, self.headers(remaining))
+                if not self._may_wait(wait, deadline, waiting):
+                    raise RateLimited('The assistant is busy right now, please try again shortly',
+                                      wait, self.headers(remaining))
+                waiting = True
+                time.sleep(wait)
+        finally:
+            if waiting:
+                self._waiting.release()
+
+    def _may_wait(self, wait, deadline, waiting):
+        """Whether to sleep another ``wait`` seconds; False (and counted as rejected) if not.
+
+        Checked on every pass, since other requests can keep pushing the wait
+        out: it must end before ``deadline``, and the first wait also needs a
+        waiter slot (``waiting`` says whether the caller holds one already).
+        """
+        if time.monotonic() + wait > deadline:
+            self.rejected += 1
+            return False
+        if not waiting:
+            # Only a few requests per worker may queue for capacity; the rest fail fast
+            if not self._waiting.acquire(blocking=False):
+                self.rejected += 1
+                return False
+            self.waited += 1
+        return True
+
+    def observe(self, model, status, headers):
+        """Update a model's quota from the provider's rate limit headers and 429s"""
+        now = time.time()
+
+        def number(name):
+            try:
+                return int(float(headers.get(name)))
+            except (TypeError, ValueError):
+                return None
+
+        def reset_at(name):
+            seconds = parse_duration(headers.get(name))
+            return now + seconds if seconds is not None else None
+
+        blocked_until = 0
+        if status == 429:
+            # Honour Retry-After (bounded); without one, back off for a second
+            retry_after = parse_duration(headers.get('retry-after'))
+            blocked_until = now + min(retry_after if retry_after is not None else 1.0, 300)
+
+        values = (number('x-ratelimit-limit-requests'), number('x-ratelimit-remaining-requests'),
+                  reset_at('x-ratelimit-reset-requests'), number('x-ratelimit-limit-tokens'),
+                  number('x-ratelimit-remaining-tokens'), reset_at('x-ratelimit-reset-tokens'))
+        if blocked_until == 0 and all(value is None for value in values):
+            return
+        self._ensure_schema()
+        self.store.execute(
+            '''INSERT INTO model_quotas (model, limit_requests, remaining_requests, requests_reset_at,
+                                         limit_tokens, remaining_tokens, tokens_reset_at, blocked_until)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (model) DO UPDATE SET
+                   limit_requests = COALESCE(excluded.limit_requests, limit_requests),
+                   remaining_requests = COALESCE(excluded.remaining_requests, remaining_requests),
+                   requests_reset_at = COALESCE(excluded.requests_reset_at, requests_reset_at),
+                   limit_tokens = COALESCE(excluded.limit_tokens, limit_tokens),
+                   remaining_tokens = COALESCE(excluded.remaining_tokens, remaining_tokens),
+                   tokens_reset_at = COALESCE(excluded.tokens_reset_at, tokens_reset_at),
+                   blocked_until = MAX(blocked_until, excluded.blocked_until)''',
+            (model,) + values + (blocked_until,))
+
+    def _quota(self, model, estimated_tokens, now):
+        """``(wait_seconds, share_left)`` for a model; share_left is 1.0 when nothing is known"""
+        row = self.store.execute(
+            '''SELECT limit_requests, remaining_requests, requests_reset_at,
+                      limit_tokens, remaining_tokens, tokens_reset_at, blocked_until
+               FROM model_quotas WHERE model = ?''', (model,)).fetchone()
+        if row is None:
+            return 0.0, 1.0
+        limit_requests, remaining_requests, requests_reset_at, limit_tokens, remaining_tokens, tokens_reset_at, \
+            blocked_until = row
+        wait = max(0.0, blocked_until - now)
+        shares = []
+        # Counts from before their reset time are stale: the quota has refilled since
+        if remaining_requests is not None and (requests_reset_at or 0) > now:
+            if remaining_requests < 1:
+                wait = max(wait, requests_reset_at - now)
+            if limit_requests:
+                shares.append(remaining_requests / limit_requests)
+        if remaining_tokens is not None and (tokens_reset_at or 0) > now:
+            if remaining_tokens < estimated_tokens:
+                wait = max(wait, tokens_reset_at - now)
+            if limit_tokens:
+                shares.append(remaining_tokens / limit_tokens)
+        return wait, min(shares) if shares else 1.0
+
+    def available(self, model, estimated_tokens=0):
+        self._ensure_schema()
+        return self._quota(model, estimated_tokens, time.time())[0] == 0
+
+    def order(self, models, estimated_tokens):
+        """``models`` (healthiest first) that have quota now, those running low on it last.
+
+        When none has, waits for the first to free up if that is within
+        ``max_wait``; otherwise raises ``RateLimited``.
+        """
+        self._ensure_schema()
+        if not models:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        waiting = False
+        try:
+            while True:
+                now = time.time()
+                quotas = [self._quota(model, estimated_tokens, now) for model in models]
+                # Models with plenty left keep their health order; those running low go last, fullest first
+                ready = [((share < self.low_quota, -share if share < self.low_quota else 0, position), model)
+                         for position, (model, (wait, share)) in enumerate(zip(models, quotas)) if wait == 0]
+                if ready:
+                    return [model for _, model in sorted(ready)]
+                wait = min(wait for wait, _ in quotas)
+                if not self._may_wait(wait, deadline, waiting):
+                    raise RateLimited('Every model is at its rate limit, please try again shortly', wait)
+                waiting = True
+                time.sleep(wait)
+        finally:
+            if waiting:
+                self._waiting.release()
+
+    def stats(self):
+        self._ensure_schema()
+        now = time.time()
+        models = {}
+        for model, remaining_requests, remaining_tokens, blocked_until in self.store.execute(
+                'SELECT model, remaining_requests, remaining_tokens, blocked_until FROM model_quotas'):
+            models[model] = {
+                'remaining_requests': remaining_requests,
+                'remaining_tokens': remaining_tokens,
+                'blocked_for': round(max(0.0, blocked_until - now), 1)
+            }
+        return {'rejected': self.rejected, 'waited': self.waited, 'models': models}
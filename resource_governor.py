@@ -0,0 +1,184 @@
+"""Resource limits for the processes that run user code.
+
+Every /execute run gets rlimits on CPU time, process count and file size,
+and Python runs also get an address-space cap. (Node and the JVM reserve
+far more virtual memory than they use, so they are capped through their
+own heap flags instead.) When ``SANDBOX_CGROUP`` points at a delegated
+cgroup v2 directory, each Python and JavaScript run also gets its own
+child cgroup with ``memory.max``, ``cpu.max`` and ``pids.max``, and
+reports its peak memory from there.
+
+RLIMIT_NPROC counts every process and thread of the user the app runs as
+(and isn't enforced for root), so it can't be a per-run limit: a Python
+run that gets it is allowed ``processes`` more than the user already has
+(gunicorn's threads, the hedging pools, other runs), and only when the run
+has no cgroup, whose ``pids.max`` is the precise per-run limit. Node and
+the JVM start threads of their own and go without it.
+"""
+import os
+import resource
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+ResourceLimits = namedtuple('ResourceLimits', ['cpu_seconds', 'memory_bytes', 'processes', 'file_size_bytes', 'cpu_quota'])
+
+
+_user_threads = {'count': 0, 'at': 0.0}
+_user_threads_lock = threading.Lock()
+
+
+def user_thread_count(max_age=5.0):
+    """Processes and threads the app's user has now (what RLIMIT_NPROC counts), refreshed every ``max_age`` seconds"""
+    with _user_threads_lock:
+        if time.monotonic() - _user_threads['at'] < max_age:
+            return _user_threads['count']
+        uid = str(os.getuid())
+        count = 0
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    status = dict(line.split(':', 1) for line in f if ':' in line)
+            except OSError:
+                continue
+            if status.get('Uid', '').split()[:1] == [uid]:
+                count += int(status.get('Threads', '1'))
+        _user_threads.update(count=count, at=time.monotonic())
+        return count
+
+
+def rlimits(limits, address_space=True, nproc=True):
+    """``{name: value}`` rlimits for one run, in the form the Python fork server takes"""
+    values = {
+        'cpu': limits.cpu_seconds,
+        'fsize': limits.file_size_bytes,
+        'core': 0
+    }
+    if address_space:
+        values['as'] = limits.memory_bytes
+    if nproc and limits.processes is not None:
+        # On top of what the user already runs, so a busy server doesn't starve the run
+        values['nproc'] = user_thread_count() + limits.processes
+    return {name: value for name, value in values.items() if value is not None}
+
+
+RLIMIT_RESOURCES = {
+    'cpu': resource.RLIMIT_CPU,
+    'as': resource.RLIMIT_AS,
+    'nproc': resource.RLIMIT_NPROC,
+    'fsize': resource.RLIMIT_FSIZE,
+    'core': resource.RLIMIT_CORE
+}
+
+
+def apply_rlimits(pid, values):
+    """Lower the limits of a running process (e.g. a pre-started worker waiting for its job)"""
+    for name, value in values.items():
+        # CPU gets a second of grace between SIGXCPU and SIGKILL
+        hard = value + 1 if name == 'cpu' else value
+        resource.prlimit(pid, RLIMIT_RESOURCES[name], (value, hard))
+
+
+def usage_from_rusage(rusage, wall_seconds):
+    return {
+        'cpu_ms': round((rusage.ru_utime + rusage.ru_stime) * 1000),
+        'max_rss_kb': rusage.ru_maxrss,
+        'wall_ms': round(wall_seconds * 1000)
+    }
+
+
+class Cgroup:
+    """One run's cgroup; add the process with ``add`` before it runs user code"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def add(self, pid):
+        with open(os.path.join(self.path, 'cgroup.procs'), 'w') as f:
+            f.write(str(pid))
+
+    def memory_peak_kb(self):
+        try:
+            with open(os.path.join(self.path, 'memory.peak')) as f:
+                return int(f.read()) // 1024
+        except (OSError, ValueError):
+            return None
+
+    def close(self):
+        kill_file = os.path.join(self.path, 'cgroup.kill')
+        if os.path.exists(kill_file):
+            try:
+                with open(kill_file, 'w') as f:
+                    f.write('1')
+            except OSError:
+                pass
+        # rmdir only succeeds once the killed processes have been reaped
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.02)
+        print(f"Could not remove sandbox cgroup {self.path}")
+
+
+class CgroupGovernor:
+    CONTROLLERS = ('memory', 'cpu', 'pids')
+
+    def __init__(self, root, limits, cpu_period=100000):
+        self.root = root
+        self.limits = limits
+        self.cpu_period = cpu_period
+        self.available = bool(root) and self._setup()
+
+    def _setup(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, 'cgroup.controllers')) as f:
+                controllers = f.read().split()
+            missing = [c for c in self.CONTROLLERS if c not in controllers]
+            if missing:
+                print(f"Sandbox cgroups disabled: {', '.join(missing)} not delegated to {self.root}")
+                return False
+            with open(os.path.join(self.root, 'cgroup.subtree_control'), 'w') as f:
+                f.write(' '.join('+' + c for c in self.CONTROLLERS))
+        except OSError as e:
+            print(f"Sandbox cgroups disabled: {e}")
+            return False
+        # Leftovers from a previous run of the app
+        for name in os.listdir(self.root):
+            if name.startswith('run-'):
+                Cgroup(os.path.join(self.root, name)).close()
+        return True
+
+    def create(self):
+        """A fresh cgroup with this governor's limits, or None when cgroups aren't available"""
+        if not self.available:
+            return None
+        path = os.path.join(self.root, 'run-' + uuid.uuid4().hex)
+        try:
+            os.mkdir(path)
+            settings = {'memory.swap.max': '0'}
+            if self.limits.memory_bytes:
+                settings['memory.max'] = str(self.limits.memory_bytes)
+            if self.limits.cpu_quota:
+                settings['cpu.max'] = f'{int(self.limits.cpu_quota * self.cpu_period)} {self.cpu_period}'
+            if self.limits.processes:
+                settings['pids.max'] = str(self.limits.processes)
+            for name, value in settings.items():
+                if os.path.exists(os.path.join(path, name)):
+                    with open(os.path.join(path, name), 'w') as f:
+                        f.write(value)
+        except OSError as e:
+            print(f"Failed to create sandbox cgroup: {e}")
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            return None
+        return Cgroup(path)
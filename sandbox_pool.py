@@ -0,0 +1,483 @@
+"""Pools of pre-started interpreter workers for /execute.
+
+Starting ``python``, ``node`` or a JVM is most of the latency of running a
+small snippet, so each language keeps a few workers started ahead of time:
+
+* Python: a fork server (sandbox_runners/python_worker.py) that forks a
+  clean child per job and is recycled after ``max_jobs`` runs.
+* JavaScript: single-use Node processes that are already booted and
+  waiting for code on stdin; a fresh spare replaces each one after its run.
+* Java: a warm JVM (sandbox_runners/JavaWorker.java) that compiles with
+  the in-process compiler and runs ``Main`` in a fresh class loader.
+
+Runs are resource-governed when a pool is given ``limits`` (rlimits, see
+resource_governor) and ``cgroups`` (a per-run cgroup v2, when available);
+results carry the run's ``usage``.
+
+Workers that time out, crash or report leftover state are killed and
+replaced in the background. ``execute`` takes an optional ``on_output``
+callback that receives ``(stream, text)`` chunks while the snippet runs
+(Python and JavaScript; Java reports its output at the end).
+"""
+import codecs
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from resource_governor import apply_rlimits, rlimits, usage_from_rusage
+
+RUNNERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox_runners')
+
+ExecutionResult = namedtuple('ExecutionResult', ['stdout', 'stderr', 'returncode', 'timed_out', 'usage'],
+                             defaults=(None,))
+
+# Output kept per stream; matches the Python fork server's own cap
+MAX_OUTPUT_BYTES = 1024 * 1024
+
+
+def drain(streams, deadline, on_output=None, limit=MAX_OUTPUT_BYTES):
+    """Read ``{name: pipe}`` until every pipe hits EOF or ``deadline`` passes.
+
+    The first ``limit`` bytes of each stream are kept and passed to
+    ``on_output(name, text)`` as they arrive; the rest is read and dropped so
+    the process never blocks on a full pipe. Returns ``({name: text}, timed_out)``.
+    """
+    fds = {pipe.fileno(): name for name, pipe in streams.items()}
+    kept = {name: bytearray() for name in streams}
+    decoders = {name: codecs.getincrementaldecoder('utf-8')(errors='replace') for name in streams}
+    timed_out = False
+    while fds:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready, _, _ = select.select(list(fds), [], [], remaining)
+        for fd in ready:
+            name = fds[fd]
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                del fds[fd]
+                continue
+            chunk = chunk[:limit - len(kept[name])]
+            if not chunk:
+                continue
+            kept[name] += chunk
+            if on_output is not None:
+                text = decoders[name].decode(chunk)
+                if text:
+                    on_output(name, text)
+    output = {name: data.decode('utf-8', errors='replace') for name, data in kept.items()}
+    return output, timed_out
+
+
+def wait_with_usage(proc, deadline):
+    """Reap ``proc`` by ``deadline`` and return its rusage, or None if it is still running"""
+    while True:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG if deadline is not None else 0)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.005)
+
+
+def run_command(args, timeout, on_output=None, merge_stderr=False, limits=None, **popen_kwargs):
+    """Run a one-off process with capped, optionally streamed output; returns an ExecutionResult.
+
+    With ``merge_stderr`` both streams are interleaved into ``stdout`` like a
+    terminal would show them. ``limits`` are rlimits (as from ``rlimits()``)
+    applied right after the process starts. On timeout the whole process
+    group is killed.
+    """
+    proc = subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        start_new_session=True,
+        **popen_kwargs
+    )
+    started = time.monotonic()
+    deadline = started + timeout
+    streams = {'stdout': proc.stdout}
+    if not merge_stderr:
+        streams['stderr'] = proc.stderr
+    try:
+        if limits:
+            apply_rlimits(proc.pid, limits)
+        output, timed_out = drain(streams, deadline, on_output)
+        rusage = None if timed_out else wait_with_usage(proc, max(deadline, time.monotonic() + 0.1))
+        if rusage is None:
+            timed_out = True
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            rusage = wait_with_usage(proc, None)
+    finally:
+        for stream in streams.values():
+            stream.close()
+    return ExecutionResult(output['stdout'], output.get('stderr', ''), proc.returncode, timed_out,
+                           usage_from_rusage(rusage, time.monotonic() - started))
+
+
+class WorkerError(Exception):
+    """The worker died or spoke out of protocol; the pool replaces it"""
+
+
+class _Worker:
+    def __init__(self, argv, protocol, cwd=None, env=None):
+        self.protocol = protocol
+        self.jobs = 0
+        self.usable = True
+        self._buffer = bytearray()
+        self.proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL if protocol else subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=True
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _readline(self, deadline):
+        # Unbuffered line reads, so select never misses lines already read ahead
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise WorkerError('Worker exited without replying')
+            self._buffer += chunk
+        line, _, rest = self._buffer.partition(b'\n')
+        self._buffer = rest
+        return line
+
+    def request(self, line, timeout, on_output=None):
+        """Send one protocol line and wait for the one-line JSON reply.
+
+        Streamed ``{"stream", "data"}`` lines before the reply go to ``on_output``.
+        """
+        self.jobs += 1
+        try:
+            self.proc.stdin.write((line + '\n').encode('utf-8'))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError(f'Worker is gone: {e}')
+
+        deadline = time.monotonic() + timeout
+        while True:
+            reply = self._readline(deadline)
+            if reply is None:
+                self.kill()
+                return None
+            reply = json.loads(reply)
+            if 'data' not in reply:
+                break
+            if on_output is not None:
+                on_output(reply['stream'], reply['data'])
+
+        if reply.get('dirty'):
+            # The snippet may have exited the worker (e.g. System.exit); report its status
+            try:
+                reply['returncode'] = self.proc.wait(timeout=0.5)
+            except subprocess.TimeoutExpired:
+                pass
+        return reply
+
+    def run_once(self, code, timeout, on_output=None):
+        """Single-use worker: hand over the code and collect its own output"""
+        self.jobs += 1
+        self.usable = False
+        started = time.monotonic()
+        deadline = started + timeout
+        try:
+            self.proc.stdin.write(code.encode('utf-8'))
+            self.proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+        output, timed_out = drain({'stdout': self.proc.stdout, 'stderr': self.proc.stderr}, deadline, on_output)
+        # None if it closed its output but kept running
+        rusage = None if timed_out else wait_with_usage(self.proc, max(deadline, time.monotonic() + 0.1))
+        if rusage is None:
+            self.kill()
+            rusage = wait_with_usage(self.proc, None)
+            timed_out = True
+        return ExecutionResult(output['stdout'], output['stderr'], -signal.SIGKILL if timed_out else self.proc.returncode,
+                               timed_out, usage_from_rusage(rusage, time.monotonic() - started))
+
+    def kill(self):
+        self.usable = False
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def close(self):
+        self.usable = False
+        if self.alive():
+            self.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            if stream:
+                stream.close()
+
+
+class WarmPool:
+    def __init__(self, name, argv, size=2, max_jobs=100, protocol=True, cwd=None, limits=None, cgroups=None,
+                 env=None):
+        self.name = name
+        self.argv = argv
+        self.env = env
+        self.size = size
+        # Protocol workers serve many jobs; single-use ones are replaced every run
+        self.max_jobs = max_jobs if protocol else 1
+        self.protocol = protocol
+        self.cwd = cwd
+        self.limits = limits
+        self.cgroups = cgroups if cgroups is not None and cgroups.available else None
+        self._idle = queue.Queue()
+        self._spawning = 0
+        self._runtime_version = None
+        self._lock = threading.Lock()
+        self.available = True
+        self.cold_starts = 0
+
+    def start(self):
+        self._replenish()
+        return self
+
+    def _spawn(self):
+        worker = _Worker(self.argv, self.protocol, cwd=self.cwd, env=self.env)
+        worker_limits = self._worker_limits()
+        if worker_limits:
+            try:
+                apply_rlimits(worker.proc.pid, worker_limits)
+            except OSError:
+                worker.close()
+                raise
+        return worker
+
+    def _worker_limits(self):
+        # rlimits for a whole worker process; per-run limits are up to each pool
+        return None
+
+    def runtime_version(self):
+        """The interpreter's ``--version`` output, or None if it isn't installed"""
+        if self._runtime_version is None:
+            try:
+                result = subprocess.run([self.argv[0], '--version'], capture_output=True, text=True, timeout=30)
+                self._runtime_version = (result.stdout + result.stderr).strip()
+            except (OSError, subprocess.TimeoutExpired):
+                return None
+        return self._runtime_version
+
+    def _create_cgroup(self):
+        return self.cgroups.create() if self.cgroups is not None else None
+
+    def _replenish(self):
+        with self._lock:
+            missing = self.size - self._idle.qsize() - self._spawning
+            if missing <= 0 or not self.available:
+                return
+            self._spawning += missing
+        threading.Thread(target=self._fill, args=(missing,), name=f'{self.name}-pool', daemon=True).start()
+
+    def _fill(self, count):
+        for started in range(count):
+            try:
+                worker = self._spawn()
+            except FileNotFoundError:
+                # Interpreter isn't installed; callers fall back to their own error path
+                print(f"{self.name} sandbox pool disabled: {self.argv[0]} not found")
+                self.available = False
+                with self._lock:
+                    self._spawning -= count - started
+                return
+            except Exception as e:
+                print(f"Failed to start {self.name} worker: {e}")
+                with self._lock:
+                    self._spawning -= 1
+                continue
+            with self._lock:
+                self._spawning -= 1
+            self._idle.put(worker)
+
+    def acquire(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                # Pool drained by a burst; pay one cold start rather than wait
+                self.cold_starts += 1
+                return self._spawn()
+            if worker.alive():
+                return worker
+            worker.close()
+
+    def release(self, worker):
+        if worker.usable and worker.alive() and worker.jobs < self.max_jobs:
+            self._idle.put(worker)
+        else:
+            worker.close()
+        self._replenish()
+
+    def run(self, code, timeout, on_output=None):
+        """Run a snippet on a single-use worker, in its own cgroup when available"""
+        worker = self.acquire()
+        cgroup = self._create_cgroup()
+        try:
+            if cgroup is not None:
+                cgroup.add(worker.proc.pid)
+            result = worker.run_once(code, timeout, on_output)
+            return _with_memory_peak(result, cgroup)
+        finally:
+            if cgroup is not None:
+                cgroup.close()
+            self.release(worker)
+
+    def request(self, line, timeout, on_output=None):
+        """Send one protocol request; returns the reply dict or None on timeout"""
+        worker = self.acquire()
+        try:
+            reply = worker.request(line, timeout, on_output)
+            if reply is not None and reply.get('dirty'):
+                worker.usable = False
+            return reply
+        except (WorkerError, ValueError):
+            worker.usable = False
+            raise
+        finally:
+            self.release(worker)
+
+    def shutdown(self):
+        self.available = False
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _reply_to_result(reply):
+    if reply is None:
+        return ExecutionResult('', '', -signal.SIGKILL, True)
+    return ExecutionResult(reply['stdout'], reply['stderr'], reply['returncode'], reply.get('timed_out', False),
+                           reply.get('usage'))
+
+
+def _with_memory_peak(result, cgroup):
+    # The cgroup's peak covers every process of the run, not just the main one
+    peak = cgroup.memory_peak_kb() if cgroup is not None else None
+    if peak is None or result.usage is None:
+        return result
+    return result._replace(usage=dict(result.usage, memory_peak_kb=peak))
+
+
+class PythonPool(WarmPool):
+    def __init__(self, size=2, max_jobs=200, python='python', limits=None, cgroups=None):
+        # A fixed hash seed keeps set and dict ordering of strings the same across
+        # fork server restarts, so cached results match what a fresh run prints
+        super().__init__('python', [python, os.path.join(RUNNERS_DIR, 'python_worker.py')],
+                         size=size, max_jobs=max_jobs, limits=limits, cgroups=cgroups,
+                         env=dict(os.environ, PYTHONHASHSEED='0'))
+
+    def execute(self, code, timeout, on_output=None):
+        # The fork server applies the limits in the child and enforces the timeout
+        # itself; allow a little slack for the reply
+        cgroup = self._create_cgroup()
+        job = {
+            'code': code,
+            'timeout': timeout,
+            'stream': on_output is not None,
+            # pids.max covers process count when the run has its own cgroup
+            'limits': rlimits(self.limits, nproc=cgroup is None) if self.limits else {},
+            'cgroup': cgroup.path if cgroup is not None else None
+        }
+        try:
+            reply = self.request(json.dumps(job), timeout + 2, on_output)
+            return _with_memory_peak(_reply_to_result(reply), cgroup)
+        finally:
+            if cgroup is not None:
+                cgroup.close()
+
+
+class NodePool(WarmPool):
+    def __init__(self, size=2, node='node', limits=None, cgroups=None):
+        argv = [node]
+        if limits is not None and limits.memory_bytes:
+            # V8 reserves far more address space than it uses, so cap its heap instead of RLIMIT_AS
+            argv.append(f'--max-old-space-size={limits.memory_bytes // (1024 * 1024)}')
+        super().__init__('javascript', argv + [os.path.join(RUNNERS_DIR, 'node_worker.js')],
+                         size=size, protocol=False, limits=limits, cgroups=cgroups)
+
+    def _worker_limits(self):
+        # Each Node worker runs exactly one snippet, so its limits are that run's limits.
+        # No RLIMIT_NPROC: it counts the server's threads too, and V8 needs threads of its own
+        return rlimits(self.limits, address_space=False, nproc=False) if self.limits else None
+
+    def execute(self, code, timeout, on_output=None):
+        return self.run(code, timeout, on_output)
+
+
+class JavaPool(WarmPool):
+    def __init__(self, class_dir, size=1, max_jobs=50, java='java', javac='javac', limits=None):
+        self.class_dir = class_dir
+        self.javac = javac
+        heap = [f'-Xmx{limits.memory_bytes // (1024 * 1024)}m'] if limits is not None and limits.memory_bytes else []
+        super().__init__('java', [java, '-XX:+UseSerialGC', '-XX:TieredStopAtLevel=1', '-Xshare:auto'] + heap +
+                                 ['-cp', class_dir, 'JavaWorker'],
+                         size=size, max_jobs=max_jobs, limits=limits)
+
+    def _worker_limits(self):
+        # The JVM serves many runs, so a CPU rlimit would add up across them; the
+        # wall-clock timeout bounds each run instead. Like Node, it gets no RLIMIT_NPROC
+        if not self.limits:
+            return None
+        worker_limits = rlimits(self.limits, address_space=False, nproc=False)
+        worker_limits.pop('cpu', None)
+        return worker_limits
+
+    def start(self):
+        # Unavailable (callers use plain javac/java) until the runner is compiled
+        self.available = False
+        threading.Thread(target=self._prepare, name='java-pool-prepare', daemon=True).start()
+        return self
+
+    def _prepare(self):
+        # The runner itself is compiled once per deploy, not per request
+        source = os.path.join(RUNNERS_DIR, 'JavaWorker.java')
+        compiled = os.path.join(self.class_dir, 'JavaWorker.class')
+        try:
+            if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(source):
+                os.makedirs(self.class_dir, exist_ok=True)
+                subprocess.run([self.javac, '-d', self.class_dir, source], check=True,
+                               capture_output=True, timeout=60)
+        except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            print(f"java sandbox pool disabled: {e}")
+            return
+        self.available = True
+        self._replenish()
+
+    def compile(self, directory, timeout):
+        return _reply_to_result(self.request(f'COMPILE {directory}', timeout))
+
+    def execute_compiled(self, directory, timeout):
+        return _reply_to_result(self.request(f'RUN {directory}', timeout))
@@ -0,0 +1,153 @@
+import javax.tools.JavaCompiler;
+import javax.tools.ToolProvider;
+import java.io.BufferedReader;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.management.ManagementFactory;
+import java.lang.management.ThreadMXBean;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * Warm JVM for /execute.
+ *
+ * Reads one command per line on stdin: "COMPILE <dir>" compiles
+ * <dir>/Main.java into <dir> with the in-process compiler, and "RUN <dir>"
+ * loads Main from <dir> in a fresh class loader and calls main(). Each
+ * command answers with one JSON line on stdout. This avoids paying JVM and
+ * javac startup for every snippet.
+ */
+public class JavaWorker {
+    // Output kept per stream, matching the Python pool's cap
+    private static final int MAX_OUTPUT_BYTES = 1024 * 1024;
+
+    private static PrintStream protocol;
+    private static ByteArrayOutputStream currentOut;
+    private static ByteArrayOutputStream currentErr;
+
+    public static void main(String[] args) throws Exception {
+        protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        // Snippets must never read the command stream
+        System.setIn(new ByteArrayInputStream(new byte[0]));
+
+        // If a snippet calls System.exit, still report what it printed
+        Runtime.getRuntime().addShutdownHook(new Thread(() -> {
+            if (currentOut != null) {
+                protocol.println(result(currentOut.toString(), currentErr.toString(), 0, true, -1, -1));
+            }
+        }));
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            int space = line.indexOf(' ');
+            if (space < 0) {
+                continue;
+            }
+            String op = line.substring(0, space);
+            String dir = line.substring(space + 1);
+            protocol.println("COMPILE".equals(op) ? compile(dir) : run(dir));
+        }
+    }
+
+    private static String compile(String dir) {
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        ByteArrayOutputStream diagnostics = new ByteArrayOutputStream();
+        int status = compiler.run(null, diagnostics, diagnostics,
+                "-d", dir, new File(dir, "Main.java").getPath());
+        return result("", diagnostics.toString(), status, false, -1, -1);
+    }
+
+    private static String run(String dir) throws Exception {
+        ByteArrayOutputStream out = new CappedOutputStream();
+        ByteArrayOutputStream err = new CappedOutputStream();
+        PrintStream originalOut = System.out;
+        PrintStream originalErr = System.err;
+        int threadsBefore = Thread.activeCount();
+        int status = 0;
+        ThreadMXBean threads = ManagementFactory.getThreadMXBean();
+        long cpuBefore = threads.getCurrentThreadCpuTime();
+        long wallBefore = System.nanoTime();
+
+        currentOut = out;
+        currentErr = err;
+        System.setOut(new PrintStream(out, true, "UTF-8"));
+        System.setErr(new PrintStream(err, true, "UTF-8"));
+        URL[] classpath = {new File(dir).toURI().toURL()};
+        try (URLClassLoader loader = new URLClassLoader(classpath, ClassLoader.getPlatformClassLoader())) {
+            Method main = loader.loadClass("Main").getMethod("main", String[].class);
+            main.invoke(null, (Object) new String[0]);
+        } catch (InvocationTargetException e) {
+            e.getCause().printStackTrace();
+            status = 1;
+        } catch (Throwable e) {
+            e.printStackTrace();
+            status = 1;
+        } finally {
+            System.out.flush();
+            System.err.flush();
+            System.setOut(originalOut);
+            System.setErr(originalErr);
+            currentOut = null;
+            currentErr = null;
+        }
+
+        // Threads left running would leak into the next job; ask to be replaced
+        boolean dirty = Thread.activeCount() > threadsBefore;
+        // CPU time of the thread that ran main(); threads the snippet started aren't counted
+        long cpuNanos = threads.getCurrentThreadCpuTime() - cpuBefore;
+        return result(out.toString("UTF-8"), err.toString("UTF-8"), status, dirty,
+                cpuNanos / 1000000, (System.nanoTime() - wallBefore) / 1000000);
+    }
+
+    /** Keeps the first MAX_OUTPUT_BYTES written and drops the rest, so a print loop can't exhaust the heap */
+    private static class CappedOutputStream extends ByteArrayOutputStream {
+        @Override
+        public synchronized void write(int b) {
+            if (count < MAX_OUTPUT_BYTES) {
+                super.write(b);
+            }
+        }
+
+        @Override
+        public synchronized void write(byte[] b, int off, int len) {
+            super.write(b, off, Math.min(len, MAX_OUTPUT_BYTES - count));
+        }
+    }
+
+    private static String result(String stdout, String stderr, int status, boolean dirty, long cpuMs, long wallMs) {
+        String usage = cpuMs < 0 ? "null" : "{\"cpu_ms\": " + cpuMs + ", \"wall_ms\": " + wallMs + "}";
+        return "{\"stdout\": " + quote(stdout) + ", \"stderr\": " + quote(stderr)
+                + ", \"returncode\": " + status + ", \"timed_out\": false, \"dirty\": " + dirty
+                + ", \"usage\": " + usage + "}";
+    }
+
+    private static String quote(String value) {
+        StringBuilder sb = new StringBuilder("\"");
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            switch (c) {
+                case '"': sb.append("\\\""); break;
+                case '\\': sb.append("\\\\"); break;
+                case '\n': sb.append("\\n"); break;
+                case '\r': sb.append("\\r"); break;
+                case '\t': sb.append("\\t"); break;
+                default:
+                    if (c < 0x20) {
+                        sb.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        sb.append(c);
+                    }
+            }
+        }
+        return sb.append('"').toString();
+    }
+}
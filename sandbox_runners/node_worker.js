@@ -0,0 +1,19 @@
+// Pre-started Node.js process for /execute.
+//
+// Node can't fork a warm interpreter, so each worker runs exactly one job:
+// it starts ahead of time, waits for the snippet on stdin and runs it as
+// the main module once stdin closes. The pool replaces it after the run.
+const Module = require('module');
+const path = require('path');
+
+const chunks = [];
+process.stdin.on('data', chunk => chunks.push(chunk));
+process.stdin.on('end', () => {
+    const code = Buffer.concat(chunks).toString('utf8');
+    const filename = path.join(process.cwd(), 'main.js');
+    const mod = new Module(filename, null);
+    mod.filename = filename;
+    mod.paths = Module._nodeModulePaths(process.cwd());
+    process.mainModule = mod;
+    mod._compile(code, filename);
+});
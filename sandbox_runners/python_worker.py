@@ -0,0 +1,165 @@
+"""Warm Python fork server for /execute.
+
+Reads one JSON job per line on stdin ({"code": ..., "timeout": ...},
+optionally with "limits" rlimits and a "cgroup" to join), forks a fresh
+child for it and writes one JSON result per line on stdout
+({"stdout", "stderr", "returncode", "timed_out", "usage"}). Jobs sent with
+"stream": true also get {"stream": "stdout"|"stderr", "data": ...} lines
+while they run, before the result. The server itself never
+runs user code, so every job starts from the same clean interpreter and
+only the fork, not interpreter startup, is paid per run.
+"""
+import builtins
+import codecs
+import json
+import os
+import resource
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+MAX_OUTPUT_BYTES = 1024 * 1024
+STREAM_INTERVAL = 0.05
+RLIMITS = {
+    'cpu': resource.RLIMIT_CPU,
+    'as': resource.RLIMIT_AS,
+    'nproc': resource.RLIMIT_NPROC,
+    'fsize': resource.RLIMIT_FSIZE,
+    'core': resource.RLIMIT_CORE
+}
+
+
+def limit_child(job):
+    if job.get('cgroup'):
+        with open(os.path.join(job['cgroup'], 'cgroup.procs'), 'w') as f:
+            f.write('0')
+    for name, value in job.get('limits', {}).items():
+        # CPU gets a second of grace between SIGXCPU and SIGKILL
+        hard = value + 1 if name == 'cpu' else value
+        resource.setrlimit(RLIMITS[name], (value, hard))
+
+
+def run_child(job, stdout_fd, stderr_fd):
+    # Own process group, so a timeout can kill anything the snippet spawned
+    os.setpgid(0, 0)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    sys.argv = ['main.py']
+
+    code = job['code']
+    status = 0
+    try:
+        limit_child(job)
+        namespace = {'__name__': '__main__', '__file__': 'main.py', '__builtins__': builtins}
+        exec(compile(code, 'main.py', 'exec'), namespace)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException as e:
+        # Drop this runner's own frame so the traceback starts at the snippet
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status & 0xFF)
+
+
+def read_capped(f):
+    f.seek(0)
+    return f.read(MAX_OUTPUT_BYTES).decode('utf-8', errors='replace')
+
+
+class OutputTail:
+    """Sends what the child has written to one of its output files since the last call"""
+
+    def __init__(self, name, f):
+        self.name = name
+        self.fd = f.fileno()
+        self.offset = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def send_new(self):
+        if self.offset >= MAX_OUTPUT_BYTES:
+            return
+        chunk = os.pread(self.fd, MAX_OUTPUT_BYTES - self.offset, self.offset)
+        if not chunk:
+            return
+        self.offset += len(chunk)
+        text = self.decoder.decode(chunk)
+        if text:
+            sys.stdout.write(json.dumps({'stream': self.name, 'data': text}) + '\n')
+            sys.stdout.flush()
+
+
+def handle(job):
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_child(job, out.fileno(), err.fileno())
+
+        tails = [OutputTail('stdout', out), OutputTail('stderr', err)] if job.get('stream') else []
+        started = last_sent = time.monotonic()
+        deadline = started + job.get('timeout', 10)
+        timed_out = False
+        while True:
+            done, status, rusage = os.wait4(pid, os.WNOHANG)
+            if done:
+                break
+            if tails and time.monotonic() - last_sent >= STREAM_INTERVAL:
+                for tail in tails:
+                    tail.send_new()
+                last_sent = time.monotonic()
+            if time.monotonic() > deadline:
+                timed_out = True
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                _, status, rusage = os.wait4(pid, 0)
+                break
+            time.sleep(0.005)
+
+        for tail in tails:
+            tail.send_new()
+        returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else (status >> 8)
+        return {
+            'stdout': read_capped(out),
+            'stderr': read_capped(err),
+            'returncode': returncode,
+            'timed_out': timed_out,
+            'usage': {
+                'cpu_ms': round((rusage.ru_utime + rusage.ru_stime) * 1000),
+                'max_rss_kb': rusage.ru_maxrss,
+                'wall_ms': round((time.monotonic() - started) * 1000)
+            }
+        }
+
+
+def main():
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = handle(json.loads(line))
+        except Exception as e:
+            result = {'stdout': '', 'stderr': f'Sandbox worker error: {e}', 'returncode': 1, 'timed_out': False}
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
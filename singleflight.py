@@ -0,0 +1,183 @@
+"""Coalesce identical in-flight calls so a burst of N equal requests costs one.
+
+Within a worker, concurrent callers with the same key wait on the first
+caller's result (``do``) or all read the same event stream (``stream``).
+Across workers, an optional lease in the host-local store lets one worker
+do the work while the others wait for its result to appear in a shared
+tier (for chat, the shared response cache).
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Broadcast:
+    """Replayable event stream: every subscriber sees every item from the start"""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.cond = threading.Condition()
+
+    def publish(self, item):
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.items) and not self.done:
+                    self.cond.wait()
+                if index >= len(self.items):
+                    return
+                item = self.items[index]
+            index += 1
+            yield item
+
+
+class SingleFlight:
+    def __init__(self, store=None, lease_seconds=30, poll_interval=0.05):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        # Optional LocalStore used to coalesce across workers
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, shared_result=None):
+        """Return ``(result, shared)``; ``shared`` is True when another caller did the work"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            with self.peer_lease(key, shared_result) as peer_result:
+                if peer_result is not None:
+                    call.result = peer_result
+                    return peer_result, True
+                call.result = fn()
+                return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stream(self, key, producer):
+        """Iterate the items of ``producer()``, shared with concurrent callers of ``key``.
+
+        The producer runs on its own thread so a follower keeps receiving
+        items even if the client that started the flight disconnects.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is None:
+                broadcast = self._streams[key] = _Broadcast()
+                self.leaders += 1
+                threading.Thread(target=self._run_stream, args=(key, producer, broadcast),
+                                 name='singleflight-stream', daemon=True).start()
+            else:
+                self.followers += 1
+        return broadcast.subscribe()
+
+    def _run_stream(self, key, producer, broadcast):
+        try:
+            for item in producer():
+                broadcast.publish(item)
+        except Exception as e:
+            print(f"Coalesced stream {key[:12]} failed: {e}")
+        finally:
+            with self._lock:
+                del self._streams[key]
+            broadcast.finish()
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('singleflight', [
+            '''CREATE TABLE IF NOT EXISTS inflight (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )'''
+        ])
+
+    @contextmanager
+    def peer_lease(self, key, shared_result):
+        """Yield another worker's result for ``key``, or None if this worker should do the work.
+
+        When no peer is working on ``key`` this worker takes the lease and
+        holds it for the duration of the ``with`` block. Otherwise it polls
+        ``shared_result()`` until the peer publishes an answer or its lease
+        ends, whichever comes first.
+        """
+        if self.store is None or shared_result is None:
+            yield None
+            return
+
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        acquired = False
+        result = None
+        try:
+            self._ensure_schema()
+            while True:
+                now = time.time()
+                acquired = self.store.execute(
+                    '''INSERT INTO inflight (key, owner, expires_at) VALUES (?, ?, ?)
+                       ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                       WHERE inflight.expires_at <= ?''',
+                    (key, owner, now + self.lease_seconds, now)).rowcount == 1
+                # Check for a published answer even after taking the lease: the
+                # peer may have finished just before it released its own
+                result = shared_result()
+                if result is not None:
+                    self.followers += 1
+                    break
+                if acquired:
+                    break
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            # Never let the coordination layer fail the request; just do the work
+            print(f"Cross-worker coalescing unavailable: {e}")
+
+        try:
+            yield result
+        finally:
+            if acquired:
+                try:
+                    self.store.execute('DELETE FROM inflight WHERE key = ? AND owner = ?', (key, owner))
+                except Exception as e:
+                    print(f"Failed to release in-flight lease: {e}")
+
+    def stats(self):
+        return {'leaders': self.leaders, 'followers': self.followers}
@@ -0,0 +1,124 @@
+"""Serving generated files with caching headers and precompressed variants.
+
+Files go out through ``send_file``, which streams them with the server's
+sendfile support and handles If-None-Match, If-Modified-Since and Range.
+Text assets can also be served as a gzip or brotli variant, compressed
+once per file version and kept on disk next to the other caches. Brotli
+is used only when the optional ``brotli`` package is installed.
+"""
+import glob
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from flask import send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def served_path(path):
+    """``path`` made absolute; send_file resolves relative paths against the app's root, not the cwd"""
+    return os.path.abspath(path)
+
+
+def file_etag(stat):
+    """Strong validator for a file version; changes whenever it is rewritten"""
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def accepted_encodings(accept_encoding):
+    encodings = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+class PrecompressedFiles:
+    def __init__(self, root, min_size=1024, max_size=8 * 1024 * 1024):
+        self.root = served_path(root)
+        self.min_size = min_size
+        self.max_size = max_size
+
+    @staticmethod
+    def compressible(mimetype):
+        return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+    def _encoders(self):
+        encoders = [('gzip', 'gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.insert(0, ('br', 'br', lambda data: brotli.compress(data, mode=brotli.MODE_TEXT)))
+        return encoders
+
+    def variant(self, path, stat, encodings):
+        """``(encoding, variant_path)`` for the best encoding the client accepts, or None"""
+        if not self.min_size <= stat.st_size <= self.max_size:
+            return None
+        prefix = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        for encoding, suffix, compress in self._encoders():
+            if encoding not in encodings:
+                continue
+            variant_path = os.path.join(self.root, f'{prefix}-{file_etag(stat)}.{suffix}')
+            if not os.path.exists(variant_path):
+                if not self._create(path, prefix, suffix, variant_path, compress):
+                    return None
+            return encoding, variant_path
+        return None
+
+    def _create(self, path, prefix, suffix, variant_path, compress):
+        with open(path, 'rb') as f:
+            data = f.read()
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            return False
+        os.makedirs(self.root, exist_ok=True)
+        # Variants of older versions of this file are no longer reachable
+        for old in glob.glob(os.path.join(self.root, f'{prefix}-*.{suffix}')):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, variant_path)
+        return True
+
+    def send(self, path, accept_encoding, has_range=False, name=None):
+        """Response for ``path`` with validators, Range support and, when it pays off, compression.
+
+        ``name`` is the file name clients see, for files stored under another name (workspace blobs).
+        """
+        name = name or os.path.basename(path)
+        stat = os.stat(path)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        etag = file_etag(stat)
+        compressible = self.compressible(mimetype)
+
+        # Ranges refer to the identity encoding, so range requests always get the file itself
+        chosen = None
+        if compressible and not has_range:
+            chosen = self.variant(path, stat, accepted_encodings(accept_encoding))
+
+        if chosen is None:
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                                 last_modified=stat.st_mtime, download_name=name)
+        else:
+            encoding, variant_path = chosen
+            response = send_file(variant_path, mimetype=mimetype, etag=f'{etag}-{encoding}', conditional=True,
+                                 last_modified=stat.st_mtime, download_name=name)
+            response.headers['Content-Encoding'] = encoding
+        if compressible:
+            response.vary.add('Accept-Encoding')
+        # Always revalidate, so an edited file shows up on the next preview reload
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
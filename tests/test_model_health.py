@@ -0,0 +1,30 @@
+import pytest
+
+from local_store import LocalStore
+from model_health import ModelHealth
+
+
+@pytest.fixture
+def health(tmp_path):
+    return ModelHealth(LocalStore(str(tmp_path / 'store.sqlite3')))
+
+
+def test_measured_primary_stays_ahead_of_untried_alternates(health):
+    for _ in range(5):
+        health.record('primary', True, 200, 1.2)
+    assert health.order(['primary', 'alt1', 'alt2']) == ['primary', 'alt1', 'alt2']
+
+
+def test_latency_reorders_only_measured_models(health):
+    health.record('primary', True, 200, 2.0)
+    health.record('alt2', True, 200, 0.5)
+    # alt1 has no samples and keeps its place; the measured models swap theirs
+    assert health.order(['primary', 'alt1', 'alt2']) == ['alt2', 'alt1', 'primary']
+
+
+def test_erroring_primary_goes_after_clean_alternates(health):
+    # 1 in 4 failing: below the circuit threshold, but less healthy than an untried model
+    for _ in range(3):
+        health.record('primary', True, 200, 1.0)
+    health.record('primary', False, 500, 1.0)
+    assert health.order(['primary', 'alt1']) == ['alt1', 'primary']
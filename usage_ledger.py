@@ -0,0 +1,188 @@
+"""Per-user usage ledger in MongoDB: tokens, models, latency, cache hits and sandbox CPU time.
+
+``record`` only appends to an in-memory buffer, so requests never wait on
+MongoDB. A background thread per worker drains the buffer every
+``flush_interval`` seconds (sooner once ``batch_size`` events are waiting)
+with one ``insert_many`` into the events collection and one ``bulk_write``
+of ``$inc`` upserts into per-user daily rollups, which is what the
+dashboard reads. If MongoDB is unreachable the batch is kept and retried;
+past ``max_buffered`` waiting events new ones are dropped and counted, so a
+long outage costs data rather than memory. Events expire after
+``retention_days``; the rollups are kept.
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from per_process import PerProcess
+
+# Event fields that are summed into the daily rollups
+SUMMED_FIELDS = ('prompt_tokens', 'completion_tokens', 'total_tokens', 'latency_ms', 'cpu_ms')
+
+
+def rollup_increments(event):
+    """``$inc`` fields one event adds to its user's daily rollup"""
+    inc = Counter({'requests': 1, f"{event['kind']}_requests": 1})
+    if event.get('cached'):
+        inc['cache_hits'] += 1
+    if event.get('coalesced'):
+        inc['coalesced'] += 1
+    if event.get('success') is False:
+        inc['failures'] += 1
+    for field in SUMMED_FIELDS:
+        if event.get(field):
+            inc[field] += event[field]
+    if event.get('model'):
+        # Dots would nest the field; model names like llama-3.1 have them
+        inc['models.' + event['model'].replace('.', '_')] += 1
+    return inc
+
+
+def sum_rollups(days):
+    """Totals of the numeric fields across daily rollups (missing fields read as 0)"""
+    totals = Counter()
+    for day in days:
+        totals.update({key: value for key, value in day.items() if isinstance(value, (int, float))})
+    return totals
+
+
+def only_duplicates(error):
+    """Whether a failed insert_many only hit events a previous attempt already wrote"""
+    errors = error.details.get('writeErrors') or []
+    return bool(errors) and all(e.get('code') == 11000 for e in errors)
+
+
+class UsageLedger:
+    def __init__(self, events_collection, daily_collection, flush_interval=2.0, batch_size=500,
+                 max_buffered=10000, retention_days=90):
+        self.events_collection = events_collection
+        self.daily_collection = daily_collection
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.retention_days = retention_days
+        self._buffer = []
+        self._lock = threading.Lock()
+        # One flush at a time, whether from the thread or at exit
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = PerProcess(self._start_thread)
+        self._indexes_ready = False
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = None
+
+    def ensure_indexes(self):
+        # Created lazily, on the flush thread, so neither startup nor requests wait on MongoDB
+        if self._indexes_ready:
+            return
+        self.events_collection.create_index([('user_id', ASCENDING), ('at', DESCENDING)])
+        if self.retention_days:
+            self.events_collection.create_index('at', expireAfterSeconds=self.retention_days * 86400)
+        self.daily_collection.create_index([('user_id', ASCENDING), ('day', DESCENDING)], unique=True)
+        self._indexes_ready = True
+
+    def _start_thread(self):
+        with self._lock:
+            # Events buffered in a parent process are the parent's to write
+            self._buffer = []
+        thread = threading.Thread(target=self._run, name='usage-ledger', daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+        return thread
+
+    def record(self, user_id, kind, **fields):
+        """Queue one usage event (``kind`` is e.g. ``chat`` or ``execute``); never blocks on MongoDB"""
+        self._flusher.get()
+        event = {key: value for key, value in fields.items() if value is not None}
+        event.update(user_id=user_id, kind=kind, at=datetime.utcnow())
+        with self._lock:
+            if len(self._buffer) >= self.max_buffered:
+                self.dropped += 1
+                return
+            self._buffer.append(event)
+            self.recorded += 1
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far; returns how many events were written"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._buffer[:self.batch_size]
+                    del self._buffer[:self.batch_size]
+                if not batch:
+                    return written
+                if not self._write(batch):
+                    with self._lock:
+                        # Keep the batch for the next flush, ahead of what arrived meanwhile
+                        self._buffer[:0] = batch
+                        overflow = len(self._buffer) - self.max_buffered
+                        if overflow > 0:
+                            del self._buffer[self.max_buffered:]
+                            self.dropped += overflow
+                    return written
+                written += len(batch)
+
+    def _write(self, batch):
+        started = time.monotonic()
+        rollups = {}
+        for event in batch:
+            key = (event['user_id'], event['at'].strftime('%Y-%m-%d'))
+            rollups.setdefault(key, Counter()).update(rollup_increments(event))
+        try:
+            self.ensure_indexes()
+            try:
+                # insert_many sets each event's _id, so a retried batch only re-inserts what's missing
+                self.events_collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                if not only_duplicates(e):
+                    raise
+            self.daily_collection.bulk_write([
+                UpdateOne({'user_id': user_id, 'day': day},
+                          {'$inc': dict(inc), '$set': {'updated_at': datetime.utcnow()}},
+                          upsert=True)
+                for (user_id, day), inc in rollups.items()
+            ], ordered=False)
+        except PyMongoError as e:
+            # A rollup write that failed part way can count its batch twice on retry
+            print(f"Could not write usage events: {e}")
+            self.failed_flushes += 1
+            return False
+        self.written += len(batch)
+        self.last_flush_ms = round((time.monotonic() - started) * 1000)
+        return True
+
+    def daily(self, user_id, days=14):
+        """The user's daily rollups for the last ``days`` days, newest first"""
+        since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        return list(self.daily_collection.find({'user_id': user_id, 'day': {'$gte': since}},
+                                               {'_id': 0, 'user_id': 0})
+                    .sort('day', DESCENDING))
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            'buffered': buffered,
+            'recorded': self.recorded,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_ms': self.last_flush_ms
+        }
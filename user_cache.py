@@ -0,0 +1,78 @@
+"""Cache of logged-in users for Flask-Login's ``user_loader``.
+
+Every request that touches ``current_user`` loads the user. Users are kept
+in an in-process LRU for ``ttl`` seconds, so page loads and API calls skip
+the MongoDB round trip. ``invalidate`` drops a user everywhere: locally at
+once, and in the other gunicorn workers through a log in the host-local
+store that each worker reads at most every ``check_interval`` seconds.
+"""
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+
+class UserCache:
+    def __init__(self, load, ttl=60, max_entries=10000, store=None, check_interval=1.0):
+        # load(user_id) -> user or None
+        self.load = load
+        self.ttl = ttl
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.store = store
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_seq = None
+        self._checked_at = 0.0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('user_cache', [
+            '''CREATE TABLE IF NOT EXISTS user_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                invalidated_at REAL NOT NULL
+            )'''
+        ])
+
+    def _apply_invalidations(self):
+        """Drop users another worker invalidated since the last check"""
+        if self.store is None or time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            self._ensure_schema()
+            if self._last_seq is None:
+                # Nothing was cached before the first check, so older entries don't matter
+                self._last_seq = self.store.execute('SELECT COALESCE(MAX(seq), 0) FROM user_invalidations').fetchone()[0]
+            else:
+                for seq, user_id in self.store.execute('SELECT seq, user_id FROM user_invalidations WHERE seq > ?',
+                                                       (self._last_seq,)):
+                    self.memory.invalidate(user_id)
+                    self._last_seq = max(self._last_seq, seq)
+            self._checked_at = time.monotonic()
+
+    def get(self, user_id):
+        self._apply_invalidations()
+        user = self.memory.get(user_id)
+        if user is None:
+            user = self.load(user_id)
+            if user is not None:
+                self.memory.set(user_id, user)
+        return user
+
+    def set(self, user_id, user):
+        self.memory.set(user_id, user)
+
+    def invalidate(self, user_id):
+        """Forget a user after their account changed, in this worker and the others"""
+        self.memory.invalidate(user_id)
+        if self.store is None:
+            return
+        self._ensure_schema()
+        now = time.time()
+        self.store.execute('INSERT INTO user_invalidations (user_id, invalidated_at) VALUES (?, ?)', (user_id, now))
+        # Entries cached before this have expired anyway
+        self.store.execute('DELETE FROM user_invalidations WHERE invalidated_at < ?', (now - self.ttl - 60,))
+
+    def stats(self):
+        return self.memory.stats()
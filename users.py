@@ -0,0 +1,85 @@
+"""User accounts stored in MongoDB.
+
+``username`` and ``email`` carry unique indexes, so logins are index
+lookups and signup is a single ``insert_one``: a taken username or email
+comes back as a duplicate-key error instead of being checked for first,
+which also closes the race between two signups for the same name.
+
+Signup is only race-free with the indexes in place, so ``ensure_indexes``
+runs when a worker boots (see gunicorn.conf.py) and raises if they can't be
+created, e.g. because existing accounts already share a username or email.
+"""
+import threading
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Field of the unique index -> message shown at signup
+DUPLICATE_MESSAGES = {
+    'username': 'Username already exists',
+    'email': 'Email already registered'
+}
+
+
+class AccountExists(Exception):
+    pass
+
+
+def duplicate_field(error):
+    """Which unique field a DuplicateKeyError is about, or None"""
+    details = error.details or {}
+    for field in details.get('keyPattern') or {}:
+        if field in DUPLICATE_MESSAGES:
+            return field
+    # Servers before 4.2 only name the index in the message
+    message = details.get('errmsg') or str(error)
+    for field in DUPLICATE_MESSAGES:
+        if f'{field}_1' in message:
+            return field
+    return None
+
+
+class UserStore:
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexes_ready = False
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        """Create the unique indexes (a no-op once they exist); raises RuntimeError if they can't be"""
+        if self._indexes_ready:
+            return
+        with self._lock:
+            if self._indexes_ready:
+                return
+            for field in DUPLICATE_MESSAGES:
+                try:
+                    self.collection.create_index(field, unique=True)
+                except OperationFailure as e:
+                    raise RuntimeError(f"Could not create the unique index on users.{field}; "
+                                       f"resolve duplicate accounts and restart: {e}") from e
+            self._indexes_ready = True
+
+    def by_username(self, username):
+        return self.collection.find_one({'username': username})
+
+    def by_id(self, user_id, projection=None):
+        try:
+            object_id = ObjectId(user_id)
+        except (InvalidId, TypeError):
+            return None
+        return self.collection.find_one({'_id': object_id}, projection)
+
+    def create(self, user_doc):
+        """Insert a new user; raises AccountExists with the message to show if the username or email is taken"""
+        try:
+            self.collection.insert_one(user_doc)
+        except DuplicateKeyError as e:
+            field = duplicate_field(e)
+            raise AccountExists(DUPLICATE_MESSAGES.get(field, 'Account already exists'))
+        return user_doc
+
+    def update_password(self, user_id, old_hash, new_hash):
+        """Swap in a rehashed password, unless it was changed in the meantime"""
+        self.collection.update_one({'_id': user_id, 'password': old_hash}, {'$set': {'password': new_hash}})
@@ -0,0 +1,187 @@
+"""Per-user workspaces for generated files, stored content-addressed.
+
+A workspace (one per user) is a manifest in the host-local store that maps
+file names to blobs. Blobs are named by the SHA-256 of their content and
+written once, so a file saved by many users, or saved again unchanged,
+takes one copy on disk, and users never overwrite each other's files. A
+batch is published with one manifest transaction, so a preview never sees
+half of a project. Names a workspace doesn't have fall back to the shared
+legacy directory, where files were written before workspaces existed.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from werkzeug.utils import safe_join
+
+from file_catalog import detect_language, list_page
+from project_files import TEMP_PREFIX, check_filenames
+from static_files import file_etag, served_path
+
+
+class WorkspaceStore:
+    def __init__(self, store, root, legacy_directory=None, gc_every=200, gc_grace=3600):
+        self.store = store
+        self.blob_root = os.path.join(served_path(root), 'blobs')
+        self.legacy_directory = served_path(legacy_directory) if legacy_directory else None
+        self.gc_every = gc_every
+        # Unreferenced blobs younger than this may be about to be referenced
+        self.gc_grace = gc_grace
+        self._puts = 0
+
+    def _ensure_schema(self):
+        self.store.ensure_schema('workspaces', [
+            '''CREATE TABLE IF NOT EXISTS workspace_files (
+                namespace TEXT NOT NULL,
+                name TEXT NOT NULL,
+                blob TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                language TEXT NOT NULL,
+                owner TEXT,
+                PRIMARY KEY (namespace, name)
+            )''',
+            'CREATE INDEX IF NOT EXISTS workspace_files_blob ON workspace_files (blob)',
+            'CREATE INDEX IF NOT EXISTS workspace_files_mtime ON workspace_files (namespace, mtime_ns, name)',
+            'CREATE INDEX IF NOT EXISTS workspace_files_size ON workspace_files (namespace, size, name)',
+            'CREATE INDEX IF NOT EXISTS workspace_files_language ON workspace_files (namespace, language, name)'
+        ])
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_root, digest[:2], digest)
+
+    def _write_blob(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            # Already stored; bump the mtime so garbage collection leaves it alone until it is referenced
+            os.utime(path)
+            return digest
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return digest
+
+    def put(self, namespace, files, owner=None):
+        """Save ``[{'filename', 'content'}]`` into a workspace all-or-nothing; returns the names"""
+        names = check_filenames(files)
+        self._ensure_schema()
+        now = time.time_ns()
+        rows = []
+        for name, f in zip(names, files):
+            data = f['content'].encode('utf-8')
+            rows.append((namespace, name, self._write_blob(data), len(data), now, detect_language(name), owner))
+
+        conn = self.store.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                '''INSERT INTO workspace_files (namespace, name, blob, size, mtime_ns, language, owner)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (namespace, name) DO UPDATE SET blob = excluded.blob, size = excluded.size,
+                       mtime_ns = excluded.mtime_ns, owner = excluded.owner''',
+                rows
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._puts += 1
+        if self._puts % self.gc_every == 0:
+            self.collect_garbage()
+        return names
+
+    def resolve(self, namespace, name):
+        """Path to read ``name`` from: the workspace's blob, else the legacy file, else None"""
+        self._ensure_schema()
+        row = self.store.execute('SELECT blob FROM workspace_files WHERE namespace = ? AND name = ?',
+                                 (namespace, name)).fetchone()
+        if row is not None:
+            return self.blob_path(row[0])
+        if self.legacy_directory:
+            path = safe_join(self.legacy_directory, name)
+            if path is not None and os.path.isfile(path):
+                return path
+        return None
+
+    def entries(self, namespace, names=None):
+        """``[(name, path, version)]`` for a workspace's files, or for ``names`` (legacy files included).
+
+        ``version`` is the blob's hash, or the file validator of a legacy file. Raises
+        FileNotFoundError for a name that can't be resolved.
+        """
+        self._ensure_schema()
+        if names is None:
+            return [(name, self.blob_path(blob), blob) for name, blob in self.store.execute(
+                'SELECT name, blob FROM workspace_files WHERE namespace = ? ORDER BY name', (namespace,))]
+
+        entries = []
+        for name in sorted(set(names)):
+            path = self.resolve(namespace, name)
+            if path is None:
+                raise FileNotFoundError(name)
+            if path.startswith(self.blob_root):
+                version = os.path.basename(path)
+            else:
+                version = file_etag(os.stat(path))
+            entries.append((name, path, version))
+        return entries
+
+    def list(self, namespace, limit=100, sort='name', descending=False, language=None, prefix=None, cursor=None):
+        """One page of a workspace's files as ``(items, next_cursor)``, like ``FileCatalog.list``"""
+        self._ensure_schema()
+        return list_page(self.store, 'workspace_files', [('namespace = ?', [namespace])],
+                         limit, sort, descending, language, prefix, cursor)
+
+    def collect_garbage(self):
+        """Delete blobs no manifest refers to any more (and stray temp files); returns how many"""
+        self._ensure_schema()
+        referenced = {blob for blob, in self.store.execute('SELECT DISTINCT blob FROM workspace_files')}
+        cutoff = time.time() - self.gc_grace
+        removed = 0
+        if not os.path.isdir(self.blob_root):
+            return removed
+        with os.scandir(self.blob_root) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        if entry.name in referenced or entry.stat().st_mtime > cutoff:
+                            continue
+                        try:
+                            os.remove(entry.path)
+                            removed += 1
+                        except OSError:
+                            pass
+        return removed
+
+    def stats(self):
+        self._ensure_schema()
+        workspaces, files, logical_bytes = self.store.execute(
+            'SELECT COUNT(DISTINCT namespace), COUNT(*), COALESCE(SUM(size), 0) FROM workspace_files'
+        ).fetchone()
+        blobs, stored_bytes = self.store.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+            '(SELECT blob, MAX(size) AS size FROM workspace_files GROUP BY blob)'
+        ).fetchone()
+        return {
+            'workspaces': workspaces,
+            'files': files,
+            'blobs': blobs,
+            'logical_bytes': logical_bytes,
+            'stored_bytes': stored_bytes
+        }